@@ -0,0 +1,225 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from itertools import count, product
+from core import constants as consts
+from core.credentials import CredentialsLoader
+from core.file import estimate_frames_to_pngs, estimate_frames_to_gif
+from core.fit import Fit, SCALES, FPS_FACTORS, MIN_FPS
+
+try:
+    import fcntl
+except ImportError:
+    # No cross process locking on Windows, threads are still covered
+    fcntl = None
+
+"""Keeps reverses inside the machine's memory and scratch disk. FFmpeg's reverse filter holds every decoded frame in
+memory and gif reverses dump every frame to the drive as a png, so both grow with width x height x frames. Each reverse
+is estimated from the probe before it starts and waits until there's room for it. Ones too big for the machine on their
+own are given up on, or with fit_to_machine shrunk the same way fitting to a host does if that will do it. Running
+reverses are kept in admission.json next to credentials.ini so every process on the machine (like queue workers)
+shares the budget, and ones left behind by processes that died are dropped"""
+
+BASE_MEMORY = 150       # MB that FFmpeg and gifski need before any frames
+YUV_BYTES_PER_PIXEL = 1.5   # Decoded yuv420 frames held by the reverse filter
+RGBA_BYTES_PER_PIXEL = 4    # Frames gifski holds while it quantizes
+GIFSKI_FRAMES = 32      # How many frames gifski works on at once
+MEMORY_SHARE = .75      # Share of physical memory reverses can use when no budget is set
+DISK_MARGIN = 500       # MB of free disk left alone when no budget is set
+WAIT_INTERVAL = 2       # How often to look for room again, other processes can't wake us
+
+
+class Needs:
+    def __init__(self, memory, disk):
+        # Both in MB
+        self.memory = memory
+        self.disk = disk
+
+    def __repr__(self):
+        return "{:.0f}MB memory, {:.0f}MB disk".format(self.memory, self.disk)
+
+
+def _frames(gif_file):
+    info = gif_file.info
+    return gif_file.frames or info.frame_count or round((info.duration or 0) * (info.fps or 0))
+
+
+def estimate(gif_file, fit: Fit = None):
+    """
+    Peak memory and scratch disk a reverse will need
+    :param gif_file: GifFile being reversed
+    :param fit: changes that will be made to it, if any
+    :return: Needs, or None if the probe didn't say enough to tell
+    """
+    info = gif_file.info
+    if not info.video:
+        return None
+    width, height = info.dimensions
+    frames = _frames(gif_file)
+    if not frames:
+        return None
+    if fit:
+        # Scaling and dropping frames happen before anything is buffered
+        width, height = width * fit.scale, height * fit.scale
+        frames = frames * fit.fps_factor
+    size = gif_file.size or 0
+    if gif_file.type == consts.GIF:
+        memory = BASE_MEMORY + width * height * RGBA_BYTES_PER_PIXEL * min(frames, GIFSKI_FRAMES) / 1000000
+        # The pngs, a copy of the input and the output gif
+        disk = estimate_frames_to_pngs(width, height, frames) + size + estimate_frames_to_gif(width, height, frames)
+    else:
+        memory = BASE_MEMORY + width * height * YUV_BYTES_PER_PIXEL * frames / 1000000 + size
+        # A copy of the input if it can't be piped, and the output
+        disk = size * 2
+    return Needs(memory, disk)
+
+
+class Admission:
+    instance = None
+
+    def __init__(self, path=None):
+        general = CredentialsLoader.get_credentials()['general']
+        self.memory = float(general.get('reverse_memory', 0)) or self.physical_memory()
+        self.disk = float(general.get('reverse_disk', 0)) or None
+        root = os.path.dirname(os.path.abspath(CredentialsLoader.path))
+        self.path = path or os.path.join(root, "admission.json")
+        self.lock_path = self.path + ".lock"
+        self.thread_lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.counter = count()
+
+    @classmethod
+    def get(cls):
+        if cls.instance is None:
+            cls.instance = cls()
+        return cls.instance
+
+    @contextmanager
+    def locked(self):
+        with self.thread_lock:
+            with open(self.lock_path, "a") as lock:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read(self):
+        """Reverses running on this machine, without the ones whose process is gone"""
+        try:
+            with open(self.path) as f:
+                reservations = json.load(f)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return {}
+        return {key: reservation for key, reservation in reservations.items() if alive(reservation['pid'])}
+
+    def _write(self, reservations):
+        # Write to a temp file and swap it in so it's never left half written
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix=".admission")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(reservations, f, indent=2)
+            os.replace(temp, self.path)
+        except Exception:
+            os.remove(temp)
+            raise
+
+    def used(self):
+        """Memory and disk in MB held by running reverses"""
+        with self.locked():
+            reservations = self._read()
+        return total(reservations, 'memory'), total(reservations, 'disk')
+
+    @staticmethod
+    def physical_memory():
+        try:
+            return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / 1000000 * MEMORY_SHARE
+        except (ValueError, OSError, AttributeError):
+            # Not something we can find out on this platform
+            return None
+
+    def disk_budget(self, disk_used=0):
+        if self.disk:
+            return self.disk
+        # Running reverses have already taken some of the free space
+        return shutil.disk_usage(".").free / 1000000 - DISK_MARGIN + disk_used
+
+    def fits(self, needs: Needs):
+        """Whether a reverse could run on this machine with nothing else going"""
+        if needs is None:
+            return True
+        return (not self.memory or needs.memory <= self.memory) and needs.disk <= self.disk_budget(self.used()[1])
+
+    def shrink(self, gif_file, fit: Fit = None):
+        """
+        Scale down and drop frames until a reverse fits the machine, on top of any fit it already had
+        :return: Fit that keeps the most of the original, or None if nothing will fit
+        """
+        base = fit or Fit()
+        fps = gif_file.info.fps
+        best = None
+        for scale, fps_factor in product(SCALES, FPS_FACTORS):
+            scale, fps_factor = scale * base.scale, fps_factor * base.fps_factor
+            if fps_factor != 1.0 and (not fps or fps * fps_factor < MIN_FPS):
+                continue
+            candidate = Fit(scale, round(fps * fps_factor, 3) if fps_factor != 1.0 else None, fps_factor,
+                            base.crf_offset)
+            if not self.fits(estimate(gif_file, candidate)):
+                continue
+            if not best or candidate.retained > best.retained:
+                best = candidate
+        return best
+
+    @contextmanager
+    def admit(self, needs: Needs):
+        """Wait until there's room for a reverse, then hold its share until it's done"""
+        if needs is None:
+            yield
+            return
+        key = "{}-{}".format(os.getpid(), next(self.counter))
+        waiting = False
+        while True:
+            with self.locked():
+                reservations = self._read()
+                memory_used, disk_used = total(reservations, 'memory'), total(reservations, 'disk')
+                # Something that fits alone always gets to run once everything else is done
+                if not reservations or \
+                        ((not self.memory or memory_used + needs.memory <= self.memory) and
+                         disk_used + needs.disk <= self.disk_budget(disk_used)):
+                    reservations[key] = {"pid": os.getpid(), "memory": needs.memory, "disk": needs.disk}
+                    self._write(reservations)
+                    break
+            if not waiting:
+                print("Waiting for room to reverse ({})".format(needs))
+                waiting = True
+            with self.condition:
+                self.condition.wait(WAIT_INTERVAL)
+        try:
+            yield
+        finally:
+            with self.locked():
+                reservations = self._read()
+                reservations.pop(key, None)
+                self._write(reservations)
+            with self.condition:
+                self.condition.notify_all()
+
+
+def total(reservations, resource):
+    return sum(reservation[resource] for reservation in reservations.values())
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Someone else's process
+        pass
+    return True
@@ -0,0 +1,73 @@
+import time
+import statistics
+
+"""Orders the summons that need reversing when more than one comes in at once, like after an outage. Rereverses and
+gifs we already have are answered while the inbox is read, everything else is sorted smallest first by the size the
+host reports, since that clears the most people's requests the soonest. How long the rest will take is estimated from
+how fast earlier reverses went"""
+
+DEFAULT_SIZE = 5        # MB to assume when the host can't tell us
+SECONDS_PER_MB = 5      # Starting guess at how long reversing and uploading takes
+SMOOTHING = .2          # Weight of the latest reverse in the running speed
+
+
+class Job:
+    def __init__(self, message, context, gif, size):
+        self.message = message
+        self.context = context
+        self.gif = gif
+        # Size as reported, cost is what it's sorted by
+        self.size = size
+        self.cost = size
+
+    def __repr__(self):
+        return "{} ({})".format(self.gif, "{:.1f}MB".format(self.size) if self.size else "unknown size")
+
+
+class Backlog:
+    # Learned across backlogs
+    seconds_per_mb = SECONDS_PER_MB
+
+    def __init__(self):
+        self.jobs = []
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def add(self, message, context, gif):
+        try:
+            size = gif.estimate()
+        except Exception as e:
+            # Only a guess, the reverse will run into whatever this was for real
+            print("Couldn't estimate {}: {}".format(gif, e))
+            size = None
+        self.jobs.append(Job(message, context, gif, size))
+
+    def drain_time(self):
+        """Seconds until everything left is reversed"""
+        return sum(job.cost for job in self.jobs) * Backlog.seconds_per_mb
+
+    def _order(self):
+        known = [job.size for job in self.jobs if job.size]
+        fallback = statistics.median(known) if known else DEFAULT_SIZE
+        for job in self.jobs:
+            job.cost = job.size or fallback
+        self.jobs.sort(key=lambda job: job.cost)
+
+    def __iter__(self):
+        """Hand out jobs cheapest first, timing each one until the next is asked for"""
+        self._order()
+        total = len(self.jobs)
+        if total > 1:
+            print("Backlog of {} reverses, about {:.0f}s to clear".format(total, self.drain_time()))
+        start = time.time()
+        while self.jobs:
+            job = self.jobs.pop(0)
+            job_start = time.time()
+            yield job
+            speed = (time.time() - job_start) / max(job.cost, .1)
+            Backlog.seconds_per_mb = (1 - SMOOTHING) * Backlog.seconds_per_mb + SMOOTHING * speed
+            if self.jobs:
+                print("{} reverses left, about {:.0f}s to clear".format(len(self.jobs), self.drain_time()))
+        if total > 1:
+            print("Cleared backlog of {} in {:.0f}s".format(total, time.time() - start))
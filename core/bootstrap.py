@@ -0,0 +1,67 @@
+from core.credentials import CredentialsLoader
+from core import constants as consts
+
+"""Importing core doesn't read the config or touch the database. Entry points get what they need from here and each
+piece is set up the first time it's asked for"""
+
+
+class Bootstrap:
+    instance = None
+
+    def __init__(self, config_file=None):
+        self.config_file = config_file
+        self._reddit = None
+        self._ghm = None
+        self._operator = None
+
+    @classmethod
+    def get(cls, config_file=None):
+        if not cls.instance:
+            cls.instance = cls(config_file)
+        return cls.instance
+
+    @property
+    def credentials(self):
+        return CredentialsLoader.get_credentials(self.config_file)
+
+    @property
+    def testing(self):
+        return self.credentials['general'].get('testing', "false").lower() == "true"
+
+    @property
+    def reddit(self):
+        if not self._reddit:
+            import praw
+            from core.requestor import CountingRequestor
+            credentials = self.credentials['reddit']
+            self._reddit = praw.Reddit(user_agent=consts.user_agent,
+                                       requestor_class=CountingRequestor,
+                                       client_id=credentials['client_id'],
+                                       client_secret=credentials['client_secret'],
+                                       username=credentials['username'],
+                                       password=credentials['password'])
+        return self._reddit
+
+    @property
+    def ghm(self):
+        """Host registry, hosts that need Reddit get the client set up here"""
+        if not self._ghm:
+            from core.gif import GifHostManager
+            self._ghm = GifHostManager(self.reddit)
+        return self._ghm
+
+    @property
+    def operator(self):
+        if not self._operator:
+            from core.operator import Operator
+            self._operator = Operator(self.reddit.redditor(self.credentials['general']['operator']), self.testing)
+        return self._operator
+
+    def database(self):
+        """Bind the history database and make sure the hosts are in it"""
+        from core.history import connect
+        connect()
+
+    def queue(self):
+        from core.queue import Queue
+        return Queue()
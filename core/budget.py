@@ -0,0 +1,142 @@
+import re
+import time
+import itertools
+import threading
+import traceback
+from core.requestor import RateBudget
+
+"""Shares Reddit's rate limit between everything the bot sends. Replies can use all of it, marking messages read
+leaves a little for replies and operator notifications leave the most. Notifications are sent from a background thread
+so they never hold up a request. When Reddit rate limits a reply, replies are held off for as long as it asked"""
+
+# Priorities, lower goes first
+REPLY = 0
+MARK_READ = 1
+NOTIFY = 2
+
+# Calls that have to be left in the rate limit before something of each priority is sent
+RESERVES = {REPLY: 0, MARK_READ: 10, NOTIFY: 30}
+
+ratelimit_wait = re.compile(r"(\d+) (second|minute)", re.IGNORECASE)
+
+# Priority: time Reddit told us to hold off sending those until
+held_until = {}
+
+
+def allows(priority):
+    if RateBudget.remaining is None or RateBudget.seconds_to_reset() == 0:
+        return True
+    return RateBudget.remaining > RESERVES[priority]
+
+
+def wait_for(priority):
+    """Block until the rate limit has room for something of this priority"""
+    while not allows(priority):
+        wait = max(RateBudget.seconds_to_reset(), 1)
+        print("Holding off for {:.0f}s to leave rate limit for more important things".format(wait))
+        time.sleep(wait)
+
+
+def parse_ratelimit(message, default=60):
+    """Seconds Reddit asked us to wait in a RATELIMIT error"""
+    match = ratelimit_wait.search(message or "")
+    if not match:
+        return default
+    return int(match[1]) * (60 if match[2].lower() == "minute" else 1)
+
+
+def hold(priority, seconds):
+    held_until[priority] = max(held_until.get(priority, 0), time.time() + seconds)
+
+
+def held(priority):
+    """Seconds left until Reddit will take something of this priority again"""
+    return max(held_until.get(priority, 0) - time.time(), 0)
+
+
+class ActionScheduler:
+    """Runs Reddit actions in the background once they're due and the rate limit allows, most important first"""
+    instance = None
+
+    def __init__(self):
+        # (due time, priority, tiebreaker, name, action)
+        self.actions = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+        self.busy = False
+        # Ignore the reserves while flushing, we're on the way out
+        self.flushing = False
+
+    @classmethod
+    def get(cls):
+        if cls.instance is None:
+            cls.instance = cls()
+        return cls.instance
+
+    def submit(self, priority, action, name="action", delay=0):
+        with self.condition:
+            self.actions.append((time.time() + delay, priority, next(self.counter), name, action))
+            self.condition.notify_all()
+            if not self.thread or not self.thread.is_alive():
+                self.running = True
+                self.thread = threading.Thread(target=self._run, name="ActionScheduler", daemon=True)
+                self.thread.start()
+
+    def __len__(self):
+        return len(self.actions)
+
+    def flush(self, timeout=30):
+        """Send everything that's waiting, whether it's due or not. Used on the way out"""
+        with self.condition:
+            self.actions = [(0, *action[1:]) for action in self.actions]
+            self.flushing = True
+            self.condition.notify_all()
+            end = time.time() + timeout
+            while (self.actions or self.busy) and self.thread and self.thread.is_alive() and time.time() < end:
+                self.condition.wait(end - time.time())
+            self.flushing = False
+        if self.actions:
+            print("Gave up on {} Reddit actions".format(len(self.actions)))
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def _next(self):
+        """The most important due action that the rate limit allows, and how long to wait if there isn't one"""
+        now = time.time()
+        due = [action for action in self.actions if action[0] <= now]
+        allowed = due if self.flushing else [action for action in due if allows(action[1])]
+        if allowed:
+            return min(allowed, key=lambda a: (a[1], a[2])), 0
+        waits = [action[0] - now for action in self.actions if action[0] > now]
+        if due:
+            # Held back by the rate limit, check again at the reset
+            waits.append(max(RateBudget.seconds_to_reset(), 1))
+        return None, min(waits) if waits else None
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while True:
+                    if not self.running:
+                        return
+                    action, wait = self._next()
+                    if action:
+                        break
+                    self.condition.wait(wait)
+                self.actions.remove(action)
+                self.busy = True
+            try:
+                action[4]()
+            except Exception:
+                # One failed action shouldn't stop the rest
+                print("Reddit action {} failed".format(action[3]))
+                traceback.print_exc()
+            finally:
+                with self.condition:
+                    self.busy = False
+                    self.condition.notify_all()
@@ -0,0 +1,61 @@
+import time
+import threading
+from collections import OrderedDict
+
+"""Short lived caches for API lookups. Extraction and analysis both look up the same media, often several times
+while walking a comment chain, and summons tend to pile up in the same threads, so the answers (including "that doesn't
+exist") are kept for a little while"""
+
+TTL = 30 * 60
+NEGATIVE_TTL = 5 * 60   # Missing media is remembered for less time in case it was still processing
+MAX_ENTRIES = 5000
+NSFW_TTL = 10 * 60      # Mods can change these so don't hold on too long
+
+MISS = object()
+
+
+class TTLCache:
+    def __init__(self, ttl=TTL, negative_ttl=NEGATIVE_TTL, max_entries=MAX_ENTRIES):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        # Key: (expiry time, value), oldest first
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=MISS):
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is None or entry[0] < time.time():
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        """Store a value, None means the thing doesn't exist and is kept for the shorter negative TTL"""
+        ttl = self.negative_ttl if value is None else self.ttl
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + ttl, value)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+# Host API metadata keyed by the API url it came from
+metadata = TTLCache()
+# Subreddit NSFW flags keyed by fullname, submissions come with theirs
+nsfw_flags = TTLCache(ttl=NSFW_TTL)
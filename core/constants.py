@@ -7,7 +7,14 @@ user_agent = f"{bot_name} v{version} by /u/pmdevita"
 spoof_user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:62.0) Gecko/20100101 Firefox/62.0"
 
 sleep_time = 90
-username = CredentialsLoader.get_credentials()['reddit']['username']
+
+
+def __getattr__(name):
+    # The username comes from the config, which is only read once something asks for it
+    if name == "username":
+        return CredentialsLoader.get_credentials()['reddit']['username']
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
+
 
 issue_link = f"https://www.reddit.com/message/compose/?to=pmdevita&subject={bot_name}%20Issue&message=" \
              "Add a link to the gif or comment in your message%2C I%27m not always sure which request is being " \
@@ -49,3 +56,4 @@ LINKGIF = 6
 SUCCESS = 0         # Reverse and upload succeeded
 USER_FAILURE = 1    # Something about the user's request doesn't make sense (ignore it)
 UPLOAD_FAILURE = 2  # The gif failed to upload (try again later)
+PENDING = 3         # Still encoding or waiting out a reply rate limit (leave it unread until it's replied to)
@@ -5,19 +5,67 @@ from core import constants as consts
 from core.regex import REPatterns
 from core.gif import GifHostManager
 from core.hosts import GifHost
+from core.moderated import ModeratedSubreddits
+from core.cache import nsfw_flags, MISS
+from core.trace import traced
 from pprint import pprint
 
-# TODO: Minimize API calls through refresh() https://praw.readthedocs.io/en/latest/code_overview/models/comment.html
+
+class ContextResolver:
+    """Loads the objects around a summon up front so walking up the comment chain doesn't fetch each parent on its
+    own. One call gets the submission and up to 8 parents of a comment, more get loaded only if the walk goes higher,
+    and the subreddit's NSFW flag is looked up in one info call unless it's cached"""
+    def __init__(self, reddit, comment):
+        self.reddit = reddit
+        # Fullname: loaded Comment or Submission
+        self.objects = {}
+        if isinstance(comment, praw.models.Submission):
+            self.submission = comment
+            self.objects[comment.fullname] = comment
+        else:
+            self.submission = None
+            self._load_context(comment)
+
+    def _load_context(self, comment):
+        path = API_PATH["submission"].format(id=comment.link_id.split("_", 1)[1]) + "_/" + comment.id
+        # Reddit caps context at 8 but asking for more doesn't hurt
+        submission_listing, comment_listing = self.reddit.get(path, params={"context": 100})
+        if not self.submission:
+            self.submission = submission_listing.children[0]
+            self.objects[self.submission.fullname] = self.submission
+        queue = list(comment_listing.children)
+        while queue:
+            item = queue.pop()
+            if isinstance(item, praw.models.Comment):
+                item._submission = self.submission
+                self.objects.setdefault(item.fullname, item)
+                queue.extend(item._replies)
+
+    def parent(self, comment):
+        if comment.parent_id not in self.objects:
+            # The walk went past what we've loaded, load the next few parents
+            self._load_context(comment)
+        return self.objects.get(comment.parent_id, None) or comment.parent()
+
+    def subreddit_nsfw(self):
+        fullname = self.submission.subreddit_id
+        nsfw = nsfw_flags.get(fullname)
+        if nsfw is MISS:
+            nsfw = next(self.reddit.info(fullnames=[fullname])).over18
+            nsfw_flags.put(fullname, nsfw)
+        return nsfw
 
 
 class CommentContext:
+    @traced("context")
     def __init__(self, reddit, comment, ghm):
         """Determine the context of a summon by grabbing what comment/submission and url it is referring too"""
         self.ghm = ghm
         self.comment = comment
         self.rereverse = False
         self.unnecessary_manual = False
-        self.nsfw = is_nsfw(comment)
+        self._resolver = ContextResolver(reddit, comment)
+        self.nsfw = is_nsfw(comment, self._resolver)
         self.distinguish = False
         self.reupload = is_reupload(comment.body)
         self.url = self.determine_target_url(reddit, self.comment)
@@ -89,15 +137,15 @@ class CommentContext:
             if reddit_object.author == consts.username and not self.rereverse and not checking_manual \
                     and not self.reupload:
                 self.rereverse = True
-                return self.determine_target_url(reddit, reddit_object.parent(), layer+1, checking_manual)
+                return self.determine_target_url(reddit, self._resolver.parent(reddit_object), layer+1,
+                                                 checking_manual)
             # If it's an AutoModerator summon, move our summon comment to the AutoMod's parent
             if reddit_object.author == "AutoModerator":
                 # IF this is layer 0, this is an Automoderator summon. Check if we are doing a comment replacement
                 if layer == 0:
                     # Delete comment if a moderator
-                    modded_subs = [i.name for i in reddit.user.me().moderated()]
-                    if reddit_object.subreddit.name in modded_subs:
-                        self.comment = reddit_object.parent()
+                    if reddit_object.subreddit.display_name in ModeratedSubreddits.get(reddit):
+                        self.comment = self._resolver.parent(reddit_object)
                         if reddit_object.stickied:
                             self.distinguish = True
                         reddit_object.mod.remove()
@@ -119,16 +167,20 @@ class CommentContext:
                 # Return it
                 if layer == 0:  # If this is the summon comment
                     # Double check they didn't needlessly give us the URL again
-                    next_url = self.determine_target_url(reddit, reddit_object.parent(), layer+1, True)
+                    next_url = self.determine_target_url(reddit, self._resolver.parent(reddit_object), layer+1, True)
                     if url == next_url:
                         self.unnecessary_manual = True
                 return url
             # We didn't find a gif, go up a level
-            return self.determine_target_url(reddit, reddit_object.parent(), layer+1, checking_manual)
+            return self.determine_target_url(reddit, self._resolver.parent(reddit_object), layer+1,
+                                             checking_manual)
 
 
 # Works but will mark a sfw gif first posted in an nsfw sub as nsfw ¯\_(ツ)_/¯
-def is_nsfw(comment):
+def is_nsfw(comment, resolver: ContextResolver = None):
+    # Use the already loaded submission and subreddit if we have them
+    if resolver:
+        return resolver.submission.over_18 or resolver.subreddit_nsfw()
     # Identify if submission is nsfw
     if isinstance(comment, praw.models.Comment):
         post_nsfw = comment.submission.over_18
@@ -0,0 +1,104 @@
+import os
+from core import constants as consts
+
+"""Encoder settings used when reversing videos. Profiles are picked by the upload host's video type and the size class
+of the video. Defaults were picked with tools/encoder_benchmark.py as the lowest CPU time that stays under the hosts'
+size limits"""
+
+SMALL = "small"     # Up to 480p
+MEDIUM = "medium"   # Up to 720p
+LARGE = "large"     # Anything bigger
+
+SIZE_CLASSES = [(640 * 480, SMALL), (1280 * 720, MEDIUM)]
+
+THREADS = os.cpu_count() or 1
+
+
+class EncoderProfile:
+    def __init__(self, name, codec, args, threads=0):
+        """
+        :param name: name used in logs and benchmarks
+        :param codec: FFmpeg video encoder
+        :param args: list of extra encoder arguments
+        :param threads: number of encoder threads, 0 lets FFmpeg decide
+        """
+        self.name = name
+        self.codec = codec
+        self.args = args
+        self.threads = threads
+
+    def params(self):
+        """FFmpeg arguments for this profile"""
+        params = ["-c:v", self.codec] + self.args
+        if self.threads:
+            params += ["-threads", str(self.threads)]
+        return params
+
+    def with_crf_offset(self, offset):
+        """Copy of this profile with the crf raised by offset"""
+        if not offset:
+            return self
+        args = self.args[:]
+        i = args.index("-crf")
+        args[i + 1] = str(int(args[i + 1]) + offset)
+        return EncoderProfile("{}+{}".format(self.name, offset), self.codec, args, self.threads)
+
+    def __repr__(self):
+        return self.name
+
+
+def x264(preset, crf):
+    return EncoderProfile("x264-{}-crf{}".format(preset, crf), "libx264", ["-preset", preset, "-crf", str(crf)])
+
+
+def vp9(cpu_used, crf, threads=THREADS):
+    # VP9 in constant quality mode needs a bitrate of 0
+    return EncoderProfile("vp9-cpu{}-crf{}".format(cpu_used, crf), "libvpx-vp9",
+                          ["-deadline", "good", "-cpu-used", str(cpu_used), "-row-mt", "1", "-crf", str(crf),
+                           "-b:v", "0"], threads)
+
+
+# Every profile the benchmark tries
+CANDIDATES = {
+    consts.MP4: [x264(preset, crf) for preset in ("ultrafast", "superfast", "veryfast", "faster", "medium")
+                 for crf in (20, 23, 26)],
+    consts.WEBM: [vp9(cpu_used, crf) for cpu_used in (4, 5, 6, 8) for crf in (30, 34, 38)],
+}
+
+# Defaults chosen from the benchmark results
+PROFILES = {
+    consts.MP4: {
+        SMALL: x264("veryfast", 20),
+        MEDIUM: x264("veryfast", 23),
+        LARGE: x264("superfast", 23),
+    },
+    consts.WEBM: {
+        SMALL: vp9(5, 30),
+        MEDIUM: vp9(6, 34),
+        LARGE: vp9(8, 34),
+    },
+}
+
+
+def size_class(width, height):
+    pixels = width * height
+    for limit, name in SIZE_CLASSES:
+        if pixels <= limit:
+            return name
+    return LARGE
+
+
+def get_profile(host, dimensions=None, video_type=None):
+    """
+    Get the encoder profile for a video being uploaded to a host
+    :param host: GifHost that will receive the video
+    :param dimensions: (width, height) of the video, assumed large if unknown
+    :param video_type: overrides the host's video type
+    :return: EncoderProfile
+    """
+    video_type = video_type or host.video_type
+    size = size_class(*dimensions) if dimensions else LARGE
+    # Hosts can override specific profiles
+    if host.encoder_profiles and size in host.encoder_profiles.get(video_type, {}):
+        return host.encoder_profiles[video_type][size]
+    return PROFILES[video_type][size]
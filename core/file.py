@@ -223,6 +223,46 @@ def has_audio(file):
     return audio
 
 
+# Top level boxes that can show up in an ISO base media file (mp4, mov)
+ISO_BOXES = {b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pdin', b'uuid', b'styp', b'sidx', b'moof'}
+
+
+def is_streamable(file):
+    """
+    Check whether FFmpeg can read a file from a pipe. MP4s with the moov atom after the media data can't be read
+    without seeking, so piping them in gives a "partial file" error or an empty output.
+    :param file: filestream to check
+    :return: False if the file is an mp4/mov with the moov atom at the end, True otherwise
+    """
+    start = file.tell()
+    try:
+        file.seek(0)
+        first = True
+        while True:
+            header = file.read(8)
+            if len(header) < 8:
+                return True
+            size = int.from_bytes(header[:4], "big")
+            box = header[4:]
+            # Not an ISO file (webm, gif), these are fine to pipe
+            if first and box not in ISO_BOXES:
+                return True
+            first = False
+            if box == b'moov':
+                return True
+            if box == b'mdat':
+                return False
+            if size == 1:   # 64 bit size follows the box type
+                size = int.from_bytes(file.read(8), "big")
+                file.seek(size - 16, os.SEEK_CUR)
+            elif size < 8:     # Box runs to the end of the file (or is broken)
+                return True
+            else:
+                file.seek(size - 8, os.SEEK_CUR)
+    finally:
+        file.seek(start)
+
+
 def estimate_frames_to_pngs(width, height, frames):
     # PIXEL_TO_SIZE = 0.5812  # 1x1 pixel is .581 in bytes
     PIXEL_TO_SIZE = 0.6812  # 1x1 pixel is .581 in bytes
@@ -0,0 +1,115 @@
+from itertools import product
+from core import constants as consts
+from core.encoders import get_profile
+from core.predict import SizePredictor
+
+"""Optional stage that shrinks a reverse to fit under a host's limits instead of failing the request. It tries every
+combination of quality, frame rate and scale steps and picks the one predicted to keep the most of the original while
+landing under the limits"""
+
+SCALES = [1.0, .85, .75, .6, .5]
+FPS_FACTORS = [1.0, .75, .5]
+CRF_OFFSETS = [0, 3, 6]
+MIN_FPS = 10
+TARGET = .9     # Aim under the limit to leave room for prediction error
+CRF_HALVING = 6     # Raising crf by this much roughly halves the size
+GIFSKI_QUALITY = 90     # gifski's default quality
+GIFSKI_QUALITY_STEP = 5     # gifski quality lost per crf offset step
+
+
+class Fit:
+    def __init__(self, scale=1.0, fps=None, fps_factor=1.0, crf_offset=0, predicted=None):
+        """
+        :param scale: factor to scale each side by
+        :param fps: frame rate of the output, None to keep the original
+        :param fps_factor: how much of the original frame rate is kept
+        :param crf_offset: how much to raise the encoder's crf (or lower gifski's quality)
+        :param predicted: predicted output size in MB
+        """
+        self.scale = scale
+        self.fps = fps
+        self.fps_factor = fps_factor
+        self.crf_offset = crf_offset
+        self.predicted = predicted
+
+    @property
+    def retained(self):
+        """Rough fraction of the original's information that is kept"""
+        return self.scale ** 2 * self.fps_factor * 2 ** (-self.crf_offset / CRF_HALVING)
+
+    def filters(self):
+        """FFmpeg video filters for this fit"""
+        filters = []
+        if self.scale != 1.0:
+            # Keep dimensions even for yuv420
+            filters.append("scale=trunc(iw*{0}/2)*2:trunc(ih*{0}/2)*2".format(self.scale))
+        if self.fps:
+            filters.append("fps={}".format(self.fps))
+        return filters
+
+    def gifski_quality(self):
+        return GIFSKI_QUALITY - GIFSKI_QUALITY_STEP * self.crf_offset // 3
+
+    def __repr__(self):
+        return "Fit(scale={}, fps={}, crf+{}, retained {:.0%})".format(self.scale, self.fps, self.crf_offset,
+                                                                      self.retained)
+
+
+def needs_fit(gif_file, host, predicted):
+    """Whether the predicted reverse is over any of the host's limits"""
+    if gif_file.type == consts.GIF:
+        return (host.gif_size_limit and predicted and predicted > host.gif_size_limit * TARGET) or \
+               (host.gif_frame_limit and gif_file.frames > host.gif_frame_limit)
+    return host.vid_size_limit and predicted and predicted > host.vid_size_limit * TARGET
+
+
+def fit_to_host(gif_file, host):
+    """
+    Find the smallest change that gets a reverse under a host's limits
+    :param gif_file: GifFile being reversed
+    :param host: GifHost the reverse will be uploaded to
+    :return: Fit, or None if nothing will fit
+    """
+    info = gif_file.info
+    if not info.video or not info.fps:
+        return None
+    predictor = SizePredictor.get()
+    if gif_file.type == consts.GIF:
+        output_type, profile = consts.GIF, None
+        size_limit, frame_limit = host.gif_size_limit, host.gif_frame_limit
+    else:
+        output_type = host.video_type
+        profile = get_profile(host, info.dimensions).name
+        size_limit, frame_limit = host.vid_size_limit, 0
+    frames = gif_file.frames or info.frame_count or round(info.duration * info.fps)
+
+    best = None
+    for scale, fps_factor, crf_offset in product(SCALES, FPS_FACTORS, CRF_OFFSETS):
+        if fps_factor != 1.0 and info.fps * fps_factor < MIN_FPS:
+            continue
+        if frame_limit and frames * fps_factor > frame_limit:
+            continue
+        predicted = predictor.predict(gif_file, output_type, profile, scale, fps_factor)
+        if predicted is None:
+            return None
+        predicted *= 2 ** (-crf_offset / CRF_HALVING)
+        if size_limit and predicted > size_limit * TARGET:
+            continue
+        fit = Fit(scale, round(info.fps * fps_factor, 3) if fps_factor != 1.0 else None, fps_factor, crf_offset,
+                  predicted)
+        if not best or fit.retained > best.retained:
+            best = fit
+    return best
+
+
+def predict_fit(gif_file, host, fit):
+    """Predicted size in MB of a reverse made with a fit for a host, None if there isn't enough data to say"""
+    if gif_file.type == consts.GIF:
+        output_type, profile = consts.GIF, None
+    else:
+        output_type = host.video_type
+        profile = get_profile(host, gif_file.info.dimensions).name
+    predicted = SizePredictor.get().predict(gif_file, output_type, profile, fit.scale, fit.fps_factor)
+    if predicted is None:
+        return None
+    return predicted * 2 ** (-fit.crf_offset / CRF_HALVING)
@@ -2,14 +2,30 @@ from typing import Optional, List
 from operator import itemgetter
 
 import os
+import re
 import importlib
 from core import constants as consts
 from core.hosts import GifHost, GifFile, ONLY_NSFW, NSFW_ALLOWED, NO_NSFW
 from core.hosts import Gif as NewGif
 from core.regex import REPatterns
+from core.encoders import get_profile
+from core.predict import SizePredictor
+from core.health import HealthTracker
 
+VIDEO = "video"
 
 
+class HostLimits:
+    """The loosest limits out of a group of hosts, anything outside of these can't go to any of them"""
+    def __init__(self, hosts):
+        def loosest(limits):
+            limits = list(limits)
+            return 0 if not limits or 0 in limits else max(limits)
+        self.gif_size_limit = loosest(h.gif_size_limit for h in hosts)
+        self.gif_frame_limit = loosest(h.gif_frame_limit for h in hosts)
+        self.vid_len_limit = loosest(h.vid_len_limit for h in hosts)
+        self.vid_size_limit = loosest(h.vid_size_limit for h in hosts)
+
 
 class GifHostManager:
     hosts = []
@@ -17,6 +33,15 @@ class GifHostManager:
     vid_priority = []
     gif_priority = []
     host_names = {}
+    # (media type, nsfw, audio): hosts that accept that kind of file, in priority order
+    capabilities = {}
+    capability_limits = {}
+    # (media type, nsfw, audio, origin host): capabilities with the origin host moved to the front
+    origin_capabilities = {}
+    # Matches any host's prefilter literal, used to narrow down which host regexes to run
+    prefilter = None
+    prefilter_hosts = {}
+    unfiltered_hosts = ()
 
     def __init__(self, reddit=None):
         if not self.hosts:
@@ -40,6 +65,8 @@ class GifHostManager:
                                            x.gif_size_limit == 0, x.gif_size_limit)) if i.can_gif]
             # GifHostManager.gif_priority = [i[0] for i in sorted(gif_priority, key=itemgetter(1))]
             GifHostManager.host_names = {i.name: i for i in self.hosts}
+            self._build_capabilities()
+            self._build_prefilter()
 
             # print("priority", self.hosts, self.vid_priority, self.gif_priority)
         if not self.reddit:
@@ -59,66 +86,134 @@ class GifHostManager:
                         found_more = True
         return classes
 
-    def extract_gif(self, text, **kwargs) -> Optional[NewGif]:
+    def _build_capabilities(self):
+        """Precompute which hosts can take each kind of file so picking one only needs to check size limits"""
+        for nsfw in (False, True):
+            for audio in (False, True):
+                for media, priority in ((consts.GIF, self.gif_priority), (VIDEO, self.vid_priority)):
+                    hosts = tuple(h for h in priority if self._allows_nsfw(h, nsfw) and
+                                  (media == consts.GIF or h.audio == audio or not audio))
+                    GifHostManager.capabilities[(media, nsfw, audio)] = hosts
+                    GifHostManager.capability_limits[(media, nsfw, audio)] = HostLimits(hosts)
+        GifHostManager.origin_capabilities = {}
+
+    def _capable_hosts(self, key, origin):
+        """Capable hosts for a kind of file, with the original gif host prioritized"""
+        hosts = self.capabilities[key]
+        if origin not in hosts:
+            return hosts
+        ordered = self.origin_capabilities.get(key + (origin,), None)
+        if ordered is None:
+            ordered = (origin,) + tuple(h for h in hosts if h is not origin)
+            GifHostManager.origin_capabilities[key + (origin,)] = ordered
+        return ordered
+
+    def _build_prefilter(self):
+        """Combine every host's literals into one pattern so text only has to be scanned once"""
+        prefilter_hosts = {}
+        for host in self.hosts:
+            for literal in host.prefilter or ():
+                prefilter_hosts.setdefault(literal, set()).add(host)
+        GifHostManager.prefilter_hosts = prefilter_hosts
+        # Longest first so overlapping literals don't shadow each other
+        literals = sorted(prefilter_hosts, key=len, reverse=True)
+        GifHostManager.prefilter = re.compile("|".join(re.escape(l) for l in literals)) if literals else None
+        GifHostManager.unfiltered_hosts = tuple(h for h in self.hosts if not h.prefilter)
+
+    def match_host(self, text):
+        """Find the highest priority host with a link in the text, returns the host and its match"""
+        candidates = set(self.unfiltered_hosts)
+        if self.prefilter:
+            for literal in set(self.prefilter.findall(text)):
+                candidates |= self.prefilter_hosts[literal]
+        if not candidates:
+            return None, None
         for host in self.hosts:
-            if host.match(text):
-                return host.get_gif(text=text, **kwargs)
+            if host in candidates:
+                match = host.find(text)
+                if match:
+                    return host, match
+        return None, None
+
+    def extract_gif(self, text, **kwargs) -> Optional[NewGif]:
+        host, match = self.match_host(text)
+        if host:
+            return host.get_gif(text=text, match=match, **kwargs)
         return None
 
-    def get_upload_host(self, gif: NewGif, file: GifFile = None, ignore: Optional[List[GifHost]] = None) -> [Optional[GifFile], Optional[GifHost]]:
-        """Return a host that can suitably upload a file of these parameters"""
+    def get_upload_host(self, gif: NewGif, file: GifFile = None, ignore: Optional[List[GifHost]] = None,
+                        fitting=False) -> [Optional[GifFile], Optional[GifHost]]:
+        """Return a host that can suitably upload a file of these parameters. If no reversed file is given, the
+        options are ranked by the predicted size of the reverse so ones no host would accept go last. With fitting,
+        size and frame limits are ignored since the reverse will be shrunk to fit them"""
         acceptable_files = []
+        unlikely_files = []
         if file:
             file_list = [file]
         else:
             file_list = gif.files
         for gif_file in file_list:
             file_hosts = []
-            # Create priority lists
-            if gif_file.type == consts.GIF:
-                priority = self.gif_priority[:]
-            else:
-                priority = self.vid_priority[:]
-
-            # We prioritize the original gif host
-            if gif_file.host in priority:
-                priority.remove(gif_file.host)
-                priority.insert(0, gif_file.host)
-            if ignore:
-                for gif_host in ignore:
-                    priority.remove(gif_host)
-
-            for host in priority:
-                if self._within_host_params(host, gif, gif_file):
+            predicted_hosts = []
+            key = (consts.GIF if gif_file.type == consts.GIF else VIDEO, bool(gif.nsfw), bool(gif_file.audio))
+            size = 0 if fitting else gif_file.size
+            # Skip the search if no host at all could take this file
+            if not self._within_host_limits(self.capability_limits[key], gif_file, size, fitting):
+                continue
+
+            for host in self._capable_hosts(key, gif_file.host):
+                if ignore and host in ignore:
+                    continue
+                if self._within_host_limits(host, gif_file, size, fitting):
                     file_hosts.append(host)
-                    print("Decided to upload to", str(host), gif_file)
-                else:
-                    print("Not within params of host", host, gif_file)
-            if file_hosts:
-                acceptable_files.append({"file": gif_file, "hosts": file_hosts})
+                    if not file:
+                        predicted = self.predict_size(gif_file, host)
+                        if predicted is None or self._within_host_limits(host, gif_file, predicted):
+                            predicted_hosts.append(host)
+            if file:
+                if file_hosts:
+                    acceptable_files.append({"file": gif_file, "hosts": self._by_health(file_hosts)})
+            # Hosts the reverse is predicted to fit go first
+            elif predicted_hosts:
+                acceptable_files.append({"file": gif_file, "hosts": self._by_health(
+                    predicted_hosts + [h for h in file_hosts if h not in predicted_hosts])})
+            elif file_hosts:
+                unlikely_files.append({"file": gif_file, "hosts": self._by_health(file_hosts)})
+        acceptable_files += unlikely_files
         return acceptable_files if acceptable_files else []
 
-    def _within_host_params(self, host: GifHost, gif: NewGif, gif_file: GifFile):
-        """Determine whether a GifFile is within a GifHost's limitations"""
-        # Several types of videos but only one type of gif
-        # Can gif check may be redundant due to priority calculations
-        if (host.NSFW == NO_NSFW) and gif.nsfw:
+    @staticmethod
+    def _by_health(hosts):
+        """Move hosts with an open circuit or no rate limit left to the back, they're only used if nothing else can
+        take the file"""
+        healthy = [host for host in hosts if host.available() and HealthTracker.available(host)]
+        return healthy + [host for host in hosts if host not in healthy]
+
+    def predict_size(self, gif_file: GifFile, host: GifHost):
+        """Predicted size in MB of reversing a file for a host"""
+        if gif_file.type == consts.GIF:
+            return SizePredictor.get().predict(gif_file, consts.GIF)
+        profile = get_profile(host, getattr(gif_file.info, "dimensions", None))
+        return SizePredictor.get().predict(gif_file, host.video_type, profile.name)
+
+    @staticmethod
+    def _allows_nsfw(host: GifHost, nsfw):
+        if (host.NSFW == NO_NSFW) and nsfw:
             return False
-        if (host.NSFW == ONLY_NSFW) and not gif.nsfw:
+        if (host.NSFW == ONLY_NSFW) and not nsfw:
             return False
+        return True
 
+    @staticmethod
+    def _within_host_limits(host, gif_file: GifFile, size=None, ignore_frames=False):
+        """Check only the size, length and frame limits of a host"""
+        if size is None:
+            size = gif_file.size
         if gif_file.type == consts.GIF:
-            if host.can_gif and (host.gif_size_limit >= gif_file.size or host.gif_size_limit == 0) and \
-               (host.gif_frame_limit >= gif_file.frames or host.gif_frame_limit == 0):
-                return True
-        else:
-            if host.can_vid and (host.vid_len_limit >= gif_file.duration or host.vid_len_limit == 0) and \
-               (host.vid_size_limit >= gif_file.size or host.vid_size_limit == 0) and \
-                    (host.audio == gif_file.audio or not gif_file.audio):
-                # Audio logic: if they match or if audio is false (meaning it doesn't matter)
-
-                return True
-        return False
+            return (host.gif_size_limit >= size or host.gif_size_limit == 0) and \
+                   (host.gif_frame_limit >= gif_file.frames or host.gif_frame_limit == 0 or ignore_frames)
+        return (host.vid_len_limit >= gif_file.duration or host.vid_len_limit == 0) and \
+               (host.vid_size_limit >= size or host.vid_size_limit == 0)
 
     def __getitem__(self, item):
         return self.host_names.get(item, None)
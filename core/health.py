@@ -0,0 +1,220 @@
+import time
+import threading
+import traceback
+import requests
+from uuid import getnode
+from collections import deque
+from core.hosts import UploadFailed, CannotUpload, PendingUpload
+from core.trace import span, size_of
+
+"""Tracks how uploads to each host are going. Hosts that keep failing have their circuit opened and get pushed to the
+back of the upload order for a cool down, after which a single probe upload decides whether they're back. Each worker
+node saves its own state to the database. A node that sees another one open a circuit opens its own too, and only
+closes it early once that node has closed its circuit again"""
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+WINDOW = 20             # Recent uploads used for the success rate and latencies
+MIN_UPLOADS = 4         # Don't open the circuit on too little data
+FAILURE_RATE = .5       # Open the circuit when at least this many uploads fail
+COOL_DOWN = 10 * 60
+MAX_COOL_DOWN = 60 * 60
+SYNC_INTERVAL = 30      # How often to pick up state from other nodes
+NODE = str(getnode())   # Same naming as the queue
+
+
+class HostHealth:
+    def __init__(self, name):
+        self.name = name
+        self.outcomes = deque(maxlen=WINDOW)
+        self.latencies = deque(maxlen=WINDOW)
+        self._state = CLOSED
+        self.opened_at = 0
+        self.cool_down = COOL_DOWN
+        self.probing = False
+        # Node whose open circuit we took on, None if it was our own
+        self.source = None
+
+    @property
+    def state(self):
+        if self._state == OPEN and time.time() - self.opened_at >= self.cool_down:
+            self._state = HALF_OPEN
+        return self._state
+
+    def available(self):
+        """Whether uploads should go to this host right now"""
+        state = self.state
+        if state == HALF_OPEN:
+            # Only let one probe through at a time
+            return not self.probing
+        return state == CLOSED
+
+    def started(self):
+        """Returns False if this would be a second probe"""
+        if self.state == HALF_OPEN:
+            if self.probing:
+                return False
+            self.probing = True
+        return True
+
+    def record(self, success, latency):
+        self.outcomes.append(success)
+        if success:
+            self.latencies.append(latency)
+        state = self.state
+        if state == HALF_OPEN:
+            self.probing = False
+            if success:
+                print("{} is healthy again".format(self.name))
+                self._close()
+                self.outcomes.clear()
+            else:
+                self._open(min(self.cool_down * 2, MAX_COOL_DOWN))
+        elif state == CLOSED and len(self.outcomes) >= MIN_UPLOADS and \
+                1 - self.success_rate() >= FAILURE_RATE:
+            self._open(COOL_DOWN)
+
+    def _open(self, cool_down, opened_at=None, source=None):
+        print("{} is unhealthy, skipping it for {}s".format(self.name, cool_down))
+        self._state = OPEN
+        self.opened_at = opened_at or time.time()
+        self.cool_down = cool_down
+        self.source = source
+
+    def _close(self):
+        self._state = CLOSED
+        self.cool_down = COOL_DOWN
+        self.source = None
+
+    def success_rate(self):
+        if not self.outcomes:
+            return None
+        return sum(self.outcomes) / len(self.outcomes)
+
+    def percentile(self, p):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(int(len(ordered) * p), len(ordered) - 1)]
+
+    def to_dict(self):
+        return {"name": self.name, "node": NODE, "state": self.state, "opened_at": self.opened_at,
+                "cool_down": self.cool_down, "success_rate": self.success_rate(), "p50": self.percentile(.5),
+                "p95": self.percentile(.95)}
+
+    def merge(self, nodes):
+        """
+        Take on the other nodes' views of this host
+        :param nodes: {node: saved state} of every other node
+        """
+        now = time.time()
+        for node, data in nodes.items():
+            # Another node opened its circuit more recently than we did and it's still cooling down
+            if data['state'] != CLOSED and data['opened_at'] > self.opened_at and \
+                    now - data['opened_at'] < data['cool_down']:
+                self._open(data['cool_down'], data['opened_at'], node)
+        # Successes elsewhere don't count, only the node we took the open circuit from can close it
+        source = nodes.get(self.source, None)
+        if self._state != CLOSED and source and source['state'] == CLOSED and source['updated'] > self.opened_at:
+            print("{} is healthy again on {}".format(self.name, self.source))
+            self._close()
+
+
+class HealthTracker:
+    hosts = {}
+    lock = threading.Lock()
+    last_sync = 0
+
+    @classmethod
+    def get(cls, name) -> HostHealth:
+        with cls.lock:
+            if name not in cls.hosts:
+                cls.hosts[name] = HostHealth(name)
+            return cls.hosts[name]
+
+    @classmethod
+    def available(cls, host):
+        """Only looks at what's in memory, the main loop calls sync to pick up other nodes"""
+        health = cls.get(host.name)
+        with cls.lock:
+            return health.available()
+
+    @classmethod
+    def started(cls, host):
+        """Mark an upload as started, returns False if it would be a second probe of a half open circuit"""
+        health = cls.get(host.name)
+        with cls.lock:
+            return health.started()
+
+    @classmethod
+    def record(cls, host, success, latency):
+        health = cls.get(host.name)
+        with cls.lock:
+            health.record(success, latency)
+        cls.save(health)
+
+    @classmethod
+    def snapshot(cls):
+        """Current health of every host, for monitoring"""
+        return [health.to_dict() for health in list(cls.hosts.values())]
+
+    @classmethod
+    def sync(cls):
+        if time.time() - cls.last_sync < SYNC_INTERVAL:
+            return
+        cls.last_sync = time.time()
+        try:
+            from core.history import load_host_health
+            hosts = {}
+            for data in load_host_health():
+                if data['node'] != NODE:
+                    hosts.setdefault(data['name'], {})[data['node']] = data
+            for name, nodes in hosts.items():
+                health = cls.get(name)
+                with cls.lock:
+                    health.merge(nodes)
+        except Exception:
+            # Health is advisory, never fail a request over it
+            traceback.print_exc()
+
+    @classmethod
+    def save(cls, health):
+        try:
+            from core.history import save_host_health
+            save_host_health(health.to_dict())
+        except Exception:
+            traceback.print_exc()
+
+
+def monitored_upload(host, file, gif_type, nsfw, audio=False):
+    """Upload to a host and record how it went"""
+    if not HealthTracker.started(host):
+        print("{} is already being probed".format(host))
+        return UploadFailed
+    start = time.time()
+    with span("upload", host=host.name, type=gif_type) as entry:
+        entry["bytes_out"] = size_of(file)
+        try:
+            result = host.upload(file, gif_type, nsfw, audio)
+        except requests.Timeout:
+            print("{} stopped responding to the upload".format(host))
+            result = UploadFailed
+        except Exception:
+            HealthTracker.record(host, False, time.time() - start)
+            raise
+        if isinstance(result, type):
+            entry["outcome"] = result.__name__
+        elif isinstance(result, PendingUpload):
+            entry["outcome"] = "pending"
+        elif not result:
+            entry["outcome"] = "failed"
+    # Encodes on the host's side count once they finish
+    if isinstance(result, PendingUpload):
+        result.on_done.append(lambda gif: HealthTracker.record(host, True, time.time() - start))
+        result.on_failed.append(lambda pending: HealthTracker.record(host, False, time.time() - start))
+    # Hosts saying they can't take a file isn't their fault
+    elif result is not CannotUpload:
+        HealthTracker.record(host, bool(result) and result is not UploadFailed, time.time() - start)
+    return result
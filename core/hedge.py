@@ -0,0 +1,116 @@
+import time
+import traceback
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from core.hosts import GifFile, GifHost, UploadFailed, CannotUpload, PendingUpload
+from core.health import monitored_upload
+from core.poller import EncodePoller
+
+"""Hedged uploads: start uploading to the first host and if it hasn't finished by a deadline, start uploading to the
+next one too. Whichever finishes first is used and the other upload is deleted. Uploads read their own handle on the
+file, which should be the request's spooled copy so the next reverse can't overwrite it while a losing upload is still
+reading. If neither finishes within UPLOAD_TIMEOUT they're left to finish (and be deleted) in the background"""
+
+executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="HedgedUpload")
+UPLOAD_TIMEOUT = 15 * 60    # Seconds to wait on a hedged upload before giving up on it
+
+
+def _open_copy(gif_file: GifFile):
+    """Each upload needs its own file handle so they don't fight over the position"""
+    if isinstance(gif_file.file, BytesIO):
+        return BytesIO(gif_file.file.getvalue())
+    return open(gif_file.file.name, "rb")
+
+
+def _upload(host: GifHost, file, gif_file: GifFile, nsfw):
+    try:
+        return monitored_upload(host, file, gif_file.type, nsfw, gif_file.audio)
+    except Exception:
+        traceback.print_exc()
+        return UploadFailed
+    finally:
+        # Pending uploads have already sent the file
+        file.close()
+
+
+def _submit(host: GifHost, gif_file: GifFile, nsfw):
+    # Opened here so it's open before the request is done with the file, even if the pool is backed up
+    file = _open_copy(gif_file)
+    future = executor.submit(_upload, host, file, gif_file, nsfw)
+    # Cancelled uploads never get to close it themselves
+    future.add_done_callback(lambda f: f.cancelled() and file.close())
+    return future
+
+
+def _succeeded(result):
+    return result and result is not UploadFailed and result is not CannotUpload
+
+
+def _delete(host: GifHost, gif):
+    """Clean up an upload that lost the race"""
+    try:
+        print("Deleting extra upload", gif)
+        host.delete(gif)
+    except NotImplementedError:
+        print("{} can't delete uploads, leaving {}".format(host, gif))
+    except Exception:
+        traceback.print_exc()
+
+
+def _discard(host, future):
+    result = future.result()
+    if isinstance(result, PendingUpload):
+        # It can only be deleted once it's done encoding
+        result.on_done.append(lambda gif: _delete(host, gif))
+        EncodePoller.get().add(result)
+    elif _succeeded(result):
+        _delete(host, result)
+
+
+def hedged_upload(hosts, gif_file: GifFile, nsfw, deadline):
+    """
+    Upload to the first host, starting an upload to the second if the first isn't done within the deadline
+    :param hosts: hosts in priority order, only the first two are used
+    :param gif_file: reversed GifFile to upload
+    :param nsfw: whether the gif is nsfw
+    :param deadline: seconds to wait on the first host before hedging
+    :return: the winning upload's result, UploadFailed if both failed or CannotUpload if neither host could take it
+    """
+    primary, secondary = hosts[0], hosts[1]
+    give_up = time.time() + UPLOAD_TIMEOUT
+    futures = {_submit(primary, gif_file, nsfw): primary}
+    done, running = wait(futures, timeout=deadline)
+    if not done:
+        print("{} missed the {}s deadline, also uploading to {}".format(primary, deadline, secondary))
+        futures[_submit(secondary, gif_file, nsfw)] = secondary
+    elif not _succeeded(next(iter(done)).result()):
+        print("{} failed, trying {}".format(primary, secondary))
+        futures[_submit(secondary, gif_file, nsfw)] = secondary
+
+    results = []
+    running = set(futures)
+    while running:
+        done, running = wait(running, timeout=max(give_up - time.time(), 0), return_when=FIRST_COMPLETED)
+        if not done:
+            print("Hedged upload timed out, leaving {} to finish in the background".format(
+                ", ".join(str(futures[future]) for future in running)))
+            for loser in running:
+                # Not started yet, so nothing to clean up
+                if not loser.cancel():
+                    loser.add_done_callback(lambda f, host=futures[loser]: _discard(host, f))
+            return UploadFailed
+        winner = next((future for future in done if _succeeded(future.result())), None)
+        if winner:
+            print("Hedged upload won by", futures[winner])
+            # Both can finish at once
+            for other in done:
+                if other is not winner:
+                    _discard(futures[other], other)
+            # Whatever is still going gets cleaned up when it finishes
+            for loser in running:
+                loser.add_done_callback(lambda f, host=futures[loser]: _discard(host, f))
+            return winner.result()
+        results += [future.result() for future in done]
+    if results and all(r is CannotUpload for r in results):
+        return CannotUpload
+    return UploadFailed
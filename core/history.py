@@ -1,5 +1,7 @@
 # Manage a database of the last few months reverses and their links in order to save time
+import time
 from datetime import date
+from threading import Lock
 from pony.orm import Database, PrimaryKey, Required, Optional, db_session, select, commit, Set, desc
 
 from core.gif import GifHostManager
@@ -8,6 +10,8 @@ from core.hosts import GifHost
 from core.credentials import CredentialsLoader
 
 db = Database()
+connect_lock = Lock()
+
 
 def bind_db(db):
     creds = CredentialsLoader.get_credentials()['database']
@@ -45,23 +49,67 @@ class Gif(db.Entity):
     last_requested_date = Optional(date)
 
 
-bind_db(db)
+class EncodeStats(db.Entity):
+    """Input parameters and output size of each reverse, used to calibrate the size predictor"""
+    id = PrimaryKey(int, auto=True)
+    profile = Required(str)
+    output_type = Required(str)
+    width = Required(int)
+    height = Required(int)
+    frames = Required(int)
+    fps = Required(float)
+    source_codec = Optional(str)
+    source_bitrate = Required(float)
+    output_size = Required(float)
+    time = Required(date)
+
+
+class FitStats(db.Entity):
+    """Reverses that were shrunk to fit a host's limits and how much quality that cost"""
+    id = PrimaryKey(int, auto=True)
+    host = Required(str)
+    scale = Required(float)
+    fps_factor = Required(float)
+    crf_offset = Required(int)
+    retained = Required(float)
+    predicted_size = Required(float)
+    output_size = Required(float)
+    time = Required(date)
+
+
+class HostHealthReport(db.Entity):
+    """Latest circuit breaker state of each host on each node"""
+    name = Required(str)
+    node = Required(str)
+    PrimaryKey(name, node)
+    state = Required(str)
+    opened_at = Required(float)
+    cool_down = Required(float)
+    success_rate = Optional(float)
+    p50 = Optional(float)
+    p95 = Optional(float)
+    updated = Required(float)
+
+
+def connect():
+    """Bind the database the first time it's needed"""
+    with connect_lock:
+        if db.provider is None:
+            bind_db(db)
+            sync_hosts()
 
-ghm = GifHostManager()
 
 def sync_hosts():
     # Double check gifhost bindings
     with db_session:
-        for host in ghm.hosts:
+        for host in GifHostManager().hosts:
             q = select(h for h in GifHosts if h.name == host.name).first()
             if not q:
                 new = GifHosts(name=host.name)
 
 
-sync_hosts()
-
-
 def check_database(original_gif: NewGif_object):
+    connect()
     # Have we reversed this gif before?
     with db_session:
         host = GifHosts[original_gif.host.name]
@@ -88,11 +136,12 @@ def check_database(original_gif: NewGif_object):
             print("Found in database!", gif.origin_id, gif.reversed_id)
             gif.last_requested_date = date.today()
             gif.total_requests += 1
-            return ghm.host_names[host.name].get_gif(id, nsfw=gif.nsfw)
+            return GifHostManager().host_names[host.name].get_gif(id, nsfw=gif.nsfw)
     return None
 
 
 def add_to_database(original_gif, reversed_gif):
+    connect()
     with db_session:
         # Extra checks for linkgif
         if original_gif.host.name == "LinkGif":
@@ -104,6 +153,7 @@ def add_to_database(original_gif, reversed_gif):
 
 
 def delete_from_database(original_gif):
+    connect()
     with db_session:
         # Select gif as original first
         query = select(g for g in Gif if g.origin_host == GifHosts[original_gif.host.name] and
@@ -121,7 +171,58 @@ def delete_from_database(original_gif):
                 gif.delete()
 
 
+def add_encode_stats(original_file, reversed_file, profile):
+    """Record how big a reverse came out, profile is the encoder profile name ("gifski" for gifs)"""
+    connect()
+    info = original_file.info
+    if not info.video or not info.fps:
+        return
+    frames = info.frame_count or round(info.duration * info.fps)
+    if not frames or not info.duration:
+        return
+    with db_session:
+        EncodeStats(profile=profile, output_type=reversed_file.type, width=info.dimensions[0],
+                    height=info.dimensions[1], frames=frames, fps=info.fps, source_codec=info.video['codec_name'],
+                    source_bitrate=original_file.size * 8 / info.duration, output_size=reversed_file.size,
+                    time=date.today())
+
+
+def add_fit_stats(host, fit, reversed_file):
+    connect()
+    with db_session:
+        FitStats(host=host.name, scale=fit.scale, fps_factor=fit.fps_factor, crf_offset=fit.crf_offset,
+                 retained=fit.retained, predicted_size=fit.predicted, output_size=reversed_file.size,
+                 time=date.today())
+
+
+def list_encode_stats(limit):
+    """Most recent encode stats"""
+    connect()
+    with db_session:
+        query = select(e for e in EncodeStats).order_by(desc(EncodeStats.id))
+        return [e.to_dict() for e in query[:limit]]
+
+
+def save_host_health(health):
+    connect()
+    with db_session:
+        data = {k: v for k, v in health.items() if k not in ('name', 'node')}
+        data['updated'] = time.time()
+        row = HostHealthReport.get(name=health['name'], node=health['node'])
+        if row:
+            row.set(**data)
+        else:
+            HostHealthReport(name=health['name'], node=health['node'], **data)
+
+
+def load_host_health():
+    connect()
+    with db_session:
+        return [h.to_dict() for h in select(h for h in HostHealthReport)]
+
+
 def list_by_oldest_access(reversed_host: GifHost, cutoff):
+    connect()
     with db_session:
         query = select(g for g in Gif if g.reversed_host == GifHosts[reversed_host.name]
                        and g.last_requested_date < cutoff).order_by(Gif.last_requested_date)
@@ -1,8 +1,12 @@
 import os
+import time
+import threading
 import requests
+from contextlib import contextmanager
 from io import BytesIO
 from core import constants as consts
 from core.file import get_frames, get_duration, has_audio, is_valid, MediaInfo, estimate_frames_to_pngs
+from core.trace import traced
 
 NO_NSFW = 1
 NSFW_ALLOWED = 2
@@ -20,7 +24,64 @@ class UploadFailed:
     pass
 
 
+# API call priorities, hosts with rate limits turn down low priority calls first
+HIGH = "high"
+LOW = "low"
+_priority = threading.local()
+
+
+@contextmanager
+def low_priority():
+    """Host API calls made in here are nice to have and can be skipped if the host is short on rate limit"""
+    previous = getattr(_priority, 'value', HIGH)
+    _priority.value = LOW
+    try:
+        yield
+    finally:
+        _priority.value = previous
+
+
+def current_priority():
+    return getattr(_priority, 'value', HIGH)
+
+
+class RateLimited(Exception):
+    def __init__(self, host):
+        super(RateLimited, self).__init__("{} is saving its rate limit for more important calls".format(host))
+        self.host = host
+
+
+class PendingUpload:
+    """An upload the host is still processing on their side. The encode poller checks on it through the host's
+    check_upload and its callbacks are run from the main loop once it's finished"""
+    def __init__(self, host, ticket, nsfw=False):
+        self.host = host
+        self.ticket = ticket
+        self.nsfw = nsfw
+        self.started = time.time()
+        self.checks = 0
+        self.on_done = []
+        self.on_failed = []
+
+    def check(self):
+        """Returns the uploaded Gif, None if it's still processing or UploadFailed"""
+        self.checks += 1
+        return self.host.check_upload(self)
+
+    def done(self, gif):
+        for callback in self.on_done:
+            callback(gif)
+
+    def failed(self):
+        for callback in self.on_failed:
+            callback(self)
+
+    def __repr__(self):
+        return "{}-{} (pending)".format(self.host.name, self.ticket)
+
+
 class GifFile:
+    @traced("probe")
     def __init__(self, file, host=None, gif_type=None, size=None, duration=None, frames=0, audio=None, conversion=None):
         self.file = file
         self.info = MediaInfo(self.file)
@@ -109,6 +170,14 @@ class Gif:
         """Analyze how to (and if possible to) download gif"""
         raise NotImplementedError
 
+    def forget(self):
+        """Drop any cached API lookups for this gif so the next analyze asks the host again"""
+        pass
+
+    def estimate(self):
+        """Rough size in MB from what the host tells us without downloading it, None if it can't say"""
+        return get_header_size(self.url)
+
 
     # def download(self) -> list:
     #     return self.files
@@ -117,6 +186,8 @@ class Gif:
 class GifHost:
     name = None
     regex = None
+    # Literal strings, one of which has to be in the text for the regex to match. None means always check the regex
+    prefilter = None
     url_template = None
     priority = 0
     ghm = None
@@ -139,6 +210,8 @@ class GifHost:
     gif_size_limit = 0
     # Gif frame count limit
     gif_frame_limit = 0
+    # Encoder profile overrides, {video_type: {size_class: EncoderProfile}}
+    encoder_profiles = None
 
     @classmethod
     def upload(cls, file, gif_type, nsfw, audio=False):
@@ -149,11 +222,24 @@ class GifHost:
         raise NotImplementedError
 
     @classmethod
-    def get_gif(cls, id=None, regex=None, text=None, **kwargs) -> Gif:
+    def available(cls):
+        """Whether the host can take uploads right now, hosts that are out of rate limit get used last"""
+        return True
+
+    @classmethod
+    def check_upload(cls, pending):
+        """Check on a PendingUpload, only needed for hosts that return them from upload"""
+        raise NotImplementedError
+
+    @classmethod
+    def get_gif(cls, id=None, regex=None, text=None, match=None, **kwargs) -> Gif:
         url = None
-        if text:
-            regex = cls.regex.findall(text)
-        if regex:
+        if text and not match and not regex:
+            match = cls.regex.search(text)
+        if match:
+            id = match_id(match)
+            url = match.group()
+        elif regex:
             id = regex[0]
             url = cls.regex.search(text).group()
         if id:
@@ -161,7 +247,12 @@ class GifHost:
 
     @classmethod
     def match(cls, text):
-        return len(cls.regex.findall(text)) != 0
+        return cls.find(text) is not None
+
+    @classmethod
+    def find(cls, text):
+        """Search text for this host's links, returns the match to pass on to get_gif"""
+        return cls.regex.search(text)
 
     def __repr__(self):
         return self.name
@@ -170,6 +261,29 @@ class GifHost:
         return self.name
 
 
+def match_id(match):
+    """The id from a match, in the same form as the first result of findall"""
+    groups = match.groups('')
+    if not groups:
+        return match.group()
+    if len(groups) == 1:
+        return groups[0]
+    return groups
+
+
+def get_header_size(url):
+    """Size in MB the server reports for a file, None if it doesn't"""
+    headers = {"User-Agent": consts.spoof_user_agent}
+    try:
+        r = requests.head(url, headers=headers, allow_redirects=True, timeout=10)
+    except requests.RequestException:
+        return None
+    length = r.headers.get("Content-Length", None)
+    if r.status_code != 200 or not length:
+        return None
+    return int(length) / 1000000
+
+
 def get_response_size(url, max=None):
     """Returns size in MB"""
     if max:
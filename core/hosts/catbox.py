@@ -1,14 +1,17 @@
 import requests
-from requests_toolbelt import MultipartEncoder
 import re
 from io import BytesIO
 
 from core.hosts import GifHost, Gif, GifFile
+from core.hosts.upload import multipart_upload
 from core.credentials import CredentialsLoader
 from core import constants as consts
 from core.file import is_valid
 
-catbox_hash = CredentialsLoader.get_credentials()['catbox']['hash']
+
+def get_hash():
+    return CredentialsLoader.get_credentials()['catbox']['hash']
+
 
 class CatboxGif(Gif):
     process_id = True
@@ -43,6 +46,7 @@ class CatboxGif(Gif):
 class CatboxHost(GifHost):
     name = "Catbox"
     regex = re.compile("https?://files\.catbox\.moe/([a-zA-Z0-9]*\.[a-zA-Z0-9]{3,4})")
+    prefilter = ("files.catbox.moe",)
     priority = 3
     gif_type = CatboxGif
     audio = True
@@ -55,11 +59,10 @@ class CatboxHost(GifHost):
     def upload(cls, file, gif_type, nsfw, audio=False):
         file.seek(0)
         mimetype = "image/gif" if gif_type == consts.GIF else "video/" + gif_type
-        files = {'reqtype': 'fileupload', 'userhash': catbox_hash, 'fileToUpload': ("file.{}".format(gif_type),
+        files = {'reqtype': 'fileupload', 'userhash': get_hash(), 'fileToUpload': ("file.{}".format(gif_type),
                                                                                      file, mimetype)}
-        m = MultipartEncoder(fields=files)
-        r = requests.post("https://catbox.moe/user/api.php", data=m, headers={'Content-Type': m.content_type,
-                                                                              'User-Agent': consts.user_agent})
+        r = multipart_upload(cls.name, "https://catbox.moe/user/api.php", files,
+                             headers={'User-Agent': consts.user_agent})
         if r.status_code == 200:
             if r.text == "Down for maintainence...":
                 return None
@@ -73,7 +76,7 @@ class CatboxHost(GifHost):
         if isinstance(gif, Gif):
             gif = [gif]
         print(" ".join([g.id for g in gif]))
-        r = requests.post("https://catbox.moe/user/api.php", data={'reqtype': 'deletefiles', 'userhash': catbox_hash,
+        r = requests.post("https://catbox.moe/user/api.php", data={'reqtype': 'deletefiles', 'userhash': get_hash(),
                                                                    'files': " ".join([g.id for g in gif])})
         print(r.content)
         return True
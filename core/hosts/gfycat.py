@@ -1,20 +1,28 @@
 import json
 import requests
-from requests_toolbelt.multipart.encoder import MultipartEncoder
 import time
 from math import ceil
 from io import BytesIO
 from pprint import pprint
 
 from core.credentials import CredentialsLoader
+from core.tokens import TokenStore
+from core.cache import metadata, MISS
 from core import constants as consts
-from core.hosts import GifHost, Gif, GifFile, NO_NSFW
+from core.hosts import GifHost, Gif, GifFile, NO_NSFW, PendingUpload, UploadFailed
+from core.hosts.upload import multipart_upload
 from core.regex import REPatterns
 
 ENCODE_TIMEOUT = 3200
 WAIT = 7
 ENCODE_LOOPS = ceil(ENCODE_TIMEOUT / WAIT)
 
+# Encode statuses
+ENCODING = "encoding"
+NOT_FOUND = "notfound"
+DONE = "done"
+FAILED = "failed"
+
 
 class InvalidRefreshToken(Exception):
     def __init__(self):
@@ -36,20 +44,18 @@ class GfycatClient:
         creds = CredentialsLoader.get_credentials()[self.CREDENTIALS_BLOCK]
         self.gfyid = creds["gfycat_id"]
         self.gfysecret = creds["gfycat_secret"]
-        self.access = creds.get('access_token', None)
-        self.refresh = creds.get('refresh_token', None)
-        self.timeout = int(creds.get('token_expiration', 0))
+        # Tokens kept in credentials.ini from before the token store
+        self.seed = {"access_token": creds.get('access_token', None), "refresh_token": creds.get('refresh_token', None),
+                     "expires": int(creds.get('token_expiration', 0))}
 
-        if self.refresh is None:
+        token = TokenStore.get().load(self.CREDENTIALS_BLOCK) or self.seed
+        if token['refresh_token'] is None:
             self.authenticate(True)
-        if self.access is None:
-            self.get_token()
-
-        # self.timeout, self.token = self._load_data()
 
     @classmethod
     def get(cls):
-        if not cls.instance:
+        # Check this class specifically so subclasses don't share the parent's instance
+        if not cls.__dict__.get('instance', None):
             cls.instance = cls()
         return cls.instance
 
@@ -90,50 +96,94 @@ class GfycatClient:
             print(r.text)
             raise
         try:
-            self.timeout = int(time.time()) + response["expires_in"]
-            self.access = response["access_token"]
-            self.refresh = response["refresh_token"]
+            token = {"access_token": response["access_token"], "refresh_token": response["refresh_token"],
+                     "expires": int(time.time()) + response["expires_in"]}
         except KeyError:
             print(r.text)
             raise
-        CredentialsLoader.set_credential(self.CREDENTIALS_BLOCK, 'refresh_token', self.refresh)
-        CredentialsLoader.set_credential(self.CREDENTIALS_BLOCK, 'access_token', self.access)
-        CredentialsLoader.set_credential(self.CREDENTIALS_BLOCK, 'token_expiration', str(self.timeout))
+        TokenStore.get().save(self.CREDENTIALS_BLOCK, token)
+
+    def refresh_token(self, token):
+        data = {"grant_type": "refresh", "client_id": self.gfyid,
+                "client_secret": self.gfysecret, "refresh_token": token['refresh_token']}
+        url = self.TOKEN_URL
+        # For some dumb reason, data has to be a string
+        r = requests.post(url, data=str(data), headers={'User-Agent': consts.user_agent})
+        try:
+            response = r.json()
+        except json.decoder.JSONDecodeError as e:
+            print(r.text)
+            raise
+        # Sometimes Gfycat randomly invalidates refresh tokens >:(
+        if r.status_code == 401:
+            raise InvalidRefreshToken
+        # Gfycat keeps the same refresh token
+        return {"access_token": response["access_token"], "refresh_token": token['refresh_token'],
+                "expires": int(time.time()) + response["expires_in"]}
 
     def get_token(self):
-        # If the token has expired, request a new one
-        if self.timeout < int(time.time()):
-            data = {"grant_type": "refresh", "client_id": self.gfyid,
-                    "client_secret": self.gfysecret, "refresh_token": self.refresh}
-            url = self.TOKEN_URL
-            # For some dumb reason, data has to be a string
-            r = requests.post(url, data=str(data), headers={'User-Agent': consts.user_agent})
-            try:
-                response = r.json()
-            except json.decoder.JSONDecodeError as e:
-                print(r.text)
-                raise
-            # Sometimes Gfycat randomly invalidates refresh tokens >:(
-            if r.status_code == 401:
-                raise InvalidRefreshToken
-            self.timeout = int(time.time()) + response["expires_in"]
-            self.access = response["access_token"]
-            CredentialsLoader.set_credential(self.CREDENTIALS_BLOCK, 'access_token', self.access)
-            CredentialsLoader.set_credential(self.CREDENTIALS_BLOCK, 'token_expiration', str(self.timeout))
-        return self.access
+        # Refreshed through the token store so other workers don't refresh it at the same time
+        return TokenStore.get().token(self.CREDENTIALS_BLOCK, self.refresh_token, self.seed)['access_token']
 
     def get_gfycat(self, id):
-        headers = {"Authorization": "Bearer {}".format(self.get_token())}
         url = self.GFYCAT_INFO.format(id)
+        info = metadata.get(url)
+        if info is not MISS:
+            return info
+        headers = {"Authorization": "Bearer {}".format(self.get_token())}
         r = requests.get(url, headers=headers)
         if r.status_code != 200:
             print("Gfycat - get problem status code {}".format(str(r.status_code)))
+            # Only remember it's gone if it actually is
+            if r.status_code == 404:
+                metadata.put(url, None)
             return None
-        return r.json()['gfyItem']
+        info = r.json()['gfyItem']
+        metadata.put(url, info)
+        return info
 
     def upload(self, filestream, media_type, nsfw=False, audio=False, title=None, description=None, noMd5=None):
+        """Upload and block until Gfycat is done encoding. Returns the gfy's id or None"""
         # If we hit a problem, restart this segment
         tries = 4
+        while tries:
+            gfyname = self.start_upload(filestream, media_type, nsfw, audio, title, description, noMd5)
+            if not gfyname:
+                return None
+
+            # Sometimes we have to wait
+            print("waiting for encode...", end=" ")
+            status, ticket = self.check_upload(gfyname)
+            for i in range(ENCODE_LOOPS):
+                if status == ENCODING:
+                    time.sleep(WAIT)
+                elif status == NOT_FOUND:
+                    print("notfoundo", end=" ")
+                    time.sleep(WAIT * 2)
+                else:
+                    break
+                status, ticket = self.check_upload(gfyname)
+
+            if status == DONE:
+                print("Done!")
+                return ticket
+            # If there was something wrong, we loop back and try again
+            if status == ENCODING:
+                print("Upload timed out? Trying again", ticket)
+            else:
+                print("Error uploading? Trying again", ticket)
+            # Retry block
+            tries -= 1
+            if tries:
+                if media_type != consts.LINK:
+                    filestream.seek(0)
+                time.sleep(5)
+        return None
+
+    def start_upload(self, filestream, media_type, nsfw=False, audio=False, title=None, description=None,
+                     noMd5=None):
+        """Get a gfyname and upload the file to it without waiting for the encode. Returns the gfyname or None"""
+        tries = 4
         while tries:
             # get gfyname
             url = self.GFYCAT_CREATE
@@ -156,24 +206,15 @@ class GfycatClient:
             r = requests.post(url, headers=headers, data=str(params))
             # print(r.text)
             try:
-                metadata = r.json()
+                response = r.json()
             except json.decoder.JSONDecodeError:
                 print(r.text)
-                if r.status_code == 401:
-                    # Retry block
-                    tries -= 1
-                    if tries:
-                        if media_type != consts.LINK:
-                            filestream.seek(0)
-                        time.sleep(5)
-                        continue
-                    else:
-                        break
-                else:
+                if r.status_code != 401:
                     raise
+                response = {}
 
-            if 'gfyname' not in metadata:
-                print(metadata)
+            if 'gfyname' not in response:
+                print(response)
                 print("What the heck???")
                 # Retry block
                 tries -= 1
@@ -181,111 +222,58 @@ class GfycatClient:
                     if media_type != consts.LINK:
                         filestream.seek(0)
                     time.sleep(5)
-                    continue
-                else:
-                    break
+                continue
 
             # upload
             if media_type != consts.LINK:
                 url = self.GFYCAT_UPLOAD
                 if media_type == consts.MP4 or media_type == consts.WEBM:
-                    files = {"key": metadata["gfyname"], "file": (metadata["gfyname"], filestream, "video/" + media_type)}
+                    files = {"key": response["gfyname"], "file": (response["gfyname"], filestream, "video/" + media_type)}
                 elif media_type == consts.GIF:
-                    files = {"key": metadata["gfyname"], "file": (metadata["gfyname"], filestream, "image/gif")}
-                m = MultipartEncoder(fields=files)
-                print("uploading to gfyid {}...".format(metadata['gfyname']))
-                r = requests.post(url, data=m, headers={'Content-Type': m.content_type, 'User-Agent': consts.user_agent})
-
-            # check status for gif's id
-            url = self.GFYCAT_STATUS.format(metadata["gfyname"])
-            headers = {'User-Agent': consts.user_agent}
-            print("waiting for encode...", end=" ")
-            r = requests.get(url, headers=headers)
-            try:
-                ticket = r.json()
-            except json.decoder.JSONDecodeError as e:
-                print(r.text)
-                raise
-            # Sometimes we have to wait
-            percentage = 0
-            notfoundo = 5
-            for i in range(ENCODE_LOOPS):
-                print(ticket)
-                if ticket.get("task", None) == "encoding":
-                    time.sleep(WAIT)
-                    r = requests.get(url, headers=headers)
-                    try:
-                        ticket = r.json()
-                    except json.decoder.JSONDecodeError as e:
-                        print(r.text)
-                        raise e
-                    # print(ticket)
-                    if float(ticket.get('progress', 0)) > percentage:
-                        percentage = float(ticket['progress'])
-                        print(percentage, end=" ")
-                elif ticket.get("task", None) == 'NotFoundo':
-                    print("notfoundo", end=" ")
-                    time.sleep(WAIT * 2)
-                    r = requests.get(url, headers=headers)
-                    ticket = r.json()
-                    # print(ticket)
-                    if float(ticket.get('progress', 0)) > percentage:
-                        percentage = float(ticket['progress'])
-                        print(percentage, end=" ")
-                else:
-                    break
-            # If there was something wrong, we loop back and try again
-            if ticket.get("task", None):
-                if ticket["task"] == "NotFoundo" or ticket["task"] == "error" or ticket['task'] == "review_issue":
-                    print("Error uploading? Trying again", ticket)
-                    # Retry block
-                    tries -= 1
-                    if tries:
-                        if media_type != consts.LINK:
-                            filestream.seek(0)
-                        time.sleep(5)
-                        continue
-                    else:
-                        break
-                elif ticket['task'] == 'encoding':
-                    print("Upload timed out? Trying again", ticket)
-                    # Retry block
-                    tries -= 1
-                    if tries:
-                        if media_type != consts.LINK:
-                            filestream.seek(0)
-                        time.sleep(5)
-                        continue
-                    else:
-                        break
-                if "gfyName" in ticket:
-                    image_id = ticket["gfyName"]
-                elif "gfyname" in ticket:
-                    image_id = ticket["gfyname"]
-                print("Done!")
-                break
-            elif ticket.get("errorMessage", None):
-                print("Gfycat upload error:", ticket['errorMessage'])
-                # Retry block
-                tries -= 1
-                if tries:
-                    if media_type != consts.LINK:
-                        filestream.seek(0)
-                    time.sleep(5)
-                    continue
-                else:
-                    break
+                    files = {"key": response["gfyname"], "file": (response["gfyname"], filestream, "image/gif")}
+                print("uploading to gfyid {}...".format(response['gfyname']))
+                r = multipart_upload(self.SERVICE_NAME, url, files, headers={'User-Agent': consts.user_agent})
+            return response["gfyname"]
+        return None
 
-        if tries:
-            # return OldGif(consts.GFYCAT, image_id, nsfw=nsfw)
-            return image_id
-        else:
-            return None
+    def check_upload(self, gfyname):
+        """
+        Check on an upload's encode
+        :return: status and either the gfy's id if it's done or the ticket
+        """
+        url = self.GFYCAT_STATUS.format(gfyname)
+        headers = {'User-Agent': consts.user_agent}
+        r = requests.get(url, headers=headers)
+        try:
+            ticket = r.json()
+        except json.decoder.JSONDecodeError as e:
+            print(r.text)
+            raise e
+        task = ticket.get("task", None)
+        if task == "encoding":
+            if float(ticket.get('progress', 0)):
+                print(ticket['progress'], end=" ")
+            return ENCODING, ticket
+        elif task == "NotFoundo":
+            return NOT_FOUND, ticket
+        elif task == "error" or task == "review_issue":
+            return FAILED, ticket
+        elif task:
+            if "gfyName" in ticket:
+                return DONE, ticket["gfyName"]
+            elif "gfyname" in ticket:
+                return DONE, ticket["gfyname"]
+        elif ticket.get("errorMessage", None):
+            print("Gfycat upload error:", ticket['errorMessage'])
+        return FAILED, ticket
 
 
 class GfycatGif(Gif):
+    def forget(self):
+        metadata.discard(self.host.API_CLIENT.GFYCAT_INFO.format(self.id))
+
     def analyze(self) -> bool:
-        self.pic = self.host.API.get_gfycat(self.id)
+        self.pic = self.host.api().get_gfycat(self.id)
         if not self.pic:
             return False
         try:
@@ -312,10 +300,18 @@ class GfycatGif(Gif):
         self.files.append(GifFile(self.file, self.host, consts.GIF, self.size, self.duration, frames, audio=audio))
         return True
 
+    def estimate(self):
+        # Cached, so analyze doesn't have to ask again
+        pic = self.host.api().get_gfycat(self.id)
+        if not pic or not pic.get('webmSize', None):
+            return None
+        return pic['webmSize'] / 1000000
+
 
 class GfycatHost(GifHost):
     name = "Gfycat"
     regex = REPatterns.gfycat
+    prefilter = ("gfycat.com",)
     url_template = "https://gfycat.com/{}"
     gif_type = GfycatGif
     audio = True
@@ -324,11 +320,28 @@ class GfycatHost(GifHost):
     vid_len_limit = 61  # This has been double verified now lol
     gif_size_limit = 1700   # Gfycat doesn't have a real limit but I doubt anything higher than this will work
     gif_frame_limit = 2100
-    API = GfycatClient.get()
+    # The client is only created once it's needed since it may need to log in
+    API_CLIENT = GfycatClient
+
+    @classmethod
+    def api(cls):
+        return cls.API_CLIENT.get()
 
     @classmethod
     def upload(cls, file, gif_type, nsfw, audio=False):
-        id = cls.API.upload(file, gif_type, nsfw=nsfw, audio=audio)
-        if id:
-            return cls.gif_type(cls, id, nsfw=nsfw)
+        """Upload without waiting on the encode, the encode poller finishes it"""
+        gfyname = cls.api().start_upload(file, gif_type, nsfw=nsfw, audio=audio)
+        if gfyname:
+            return PendingUpload(cls, gfyname, nsfw=nsfw)
+        return UploadFailed
+
+    @classmethod
+    def check_upload(cls, pending):
+        status, result = cls.api().check_upload(pending.ticket)
+        if status == DONE:
+            return cls.gif_type(cls, result, nsfw=pending.nsfw)
+        if status == FAILED:
+            print("Gfycat encode failed", result)
+            return UploadFailed
+        return None
 
@@ -5,11 +5,14 @@ import requests
 import json
 from io import BytesIO
 from pprint import pprint
-from requests_toolbelt.multipart.encoder import MultipartEncoder
 
 from core.credentials import CredentialsLoader
+from core.tokens import TokenStore
+from core.cache import metadata, MISS
 from core import constants as consts
-from core.hosts import GifHost, Gif, GifFile, NO_NSFW, UploadFailed, CannotUpload
+from core.hosts import GifHost, Gif, GifFile, NO_NSFW, UploadFailed, CannotUpload, RateLimited, HIGH, LOW, \
+    current_priority
+from core.hosts.upload import multipart_upload
 from core.regex import REPatterns
 from core.file import get_duration, is_valid
 
@@ -20,8 +23,65 @@ class InvalidRefreshToken(Exception):
 
 
 class ImgurFailedRequest(Exception):
-    def __init__(self):
+    def __init__(self, status_code=None):
         super(ImgurFailedRequest, self).__init__("Something went wrong with the request")
+        self.status_code = status_code
+
+
+class ImgurCredits:
+    """Credits left on our client ID going by the X-RateLimit headers of the last response. Unknown until the first
+    response comes back. Low priority calls stop once we're down to the reserve so there's always some left for
+    requests people are waiting on"""
+    LOW_RESERVE = .2        # Fraction of the limit kept for high priority calls
+    UPLOAD_COST = 10        # Imgur charges 10 credits per upload
+    BLOCKED_WAIT = 60 * 60  # How long to back off after a 429 that doesn't say when to come back
+    client_remaining = None
+    client_limit = None
+    user_remaining = None
+    user_limit = None
+    user_reset = 0
+    blocked_until = 0
+
+    @classmethod
+    def update(cls, r):
+        headers = r.headers
+        if 'X-RateLimit-ClientRemaining' in headers:
+            cls.client_remaining = int(headers['X-RateLimit-ClientRemaining'])
+            cls.client_limit = int(headers.get('X-RateLimit-ClientLimit', cls.client_remaining))
+        if 'X-RateLimit-UserRemaining' in headers:
+            cls.user_remaining = int(headers['X-RateLimit-UserRemaining'])
+            cls.user_limit = int(headers.get('X-RateLimit-UserLimit', cls.user_remaining))
+            cls.user_reset = int(headers.get('X-RateLimit-UserReset', 0))
+        if r.status_code == 429:
+            if headers.get('X-Post-Rate-Limit-Reset', None):
+                wait = int(headers['X-Post-Rate-Limit-Reset'])
+            elif cls.user_reset > time.time():
+                wait = cls.user_reset - time.time()
+            else:
+                wait = cls.BLOCKED_WAIT
+            print("Imgur is rate limiting us for {:.0f}s".format(wait))
+            cls.blocked_until = time.time() + wait
+
+    @classmethod
+    def allow(cls, priority=HIGH, cost=1):
+        if time.time() < cls.blocked_until:
+            return False
+        limits = [(cls.client_remaining, cls.client_limit)]
+        # User credits reset every hour
+        if cls.user_reset > time.time():
+            limits.append((cls.user_remaining, cls.user_limit))
+        for remaining, limit in limits:
+            if remaining is None:
+                continue
+            reserve = limit * cls.LOW_RESERVE if priority == LOW else 0
+            if remaining - cost < reserve:
+                return False
+        return True
+
+    @classmethod
+    def summary(cls):
+        return {"client": (cls.client_remaining, cls.client_limit), "user": (cls.user_remaining, cls.user_limit),
+                "user_reset": cls.user_reset, "blocked_until": cls.blocked_until}
 
 
 class ImgurClient:
@@ -42,14 +102,13 @@ class ImgurClient:
         creds = CredentialsLoader.get_credentials()[self.CREDENTIALS_BLOCK]
         self.client_id = creds["imgur_id"]
         self.client_secret = creds["imgur_secret"]
-        self.access = creds.get('access_token', None)
-        self.refresh = creds.get('refresh_token', None)
-        self.timeout = int(creds.get('token_expiration', 0))
+        # Tokens kept in credentials.ini from before the token store
+        self.seed = {"access_token": creds.get('access_token', None), "refresh_token": creds.get('refresh_token', None),
+                     "expires": int(creds.get('token_expiration', 0))}
 
-        if self.refresh is None:
+        token = TokenStore.get().load(self.CREDENTIALS_BLOCK) or self.seed
+        if token['refresh_token'] is None:
             self.authenticate()
-        if self.access is None:
-            self.get_token()
 
     @classmethod
     def get(cls):
@@ -68,81 +127,112 @@ class ImgurClient:
         params = urllib.parse.parse_qs(parts.fragment)
         print(parts, params)
 
-        self.timeout = int(time.time()) + int(params["expires_in"][0])  # [0] quirk of parse_qs
-        self.access = params["access_token"][0]
-        self.refresh = params["refresh_token"][0]
-        CredentialsLoader.set_credential(self.CREDENTIALS_BLOCK, 'refresh_token', self.refresh)
-        CredentialsLoader.set_credential(self.CREDENTIALS_BLOCK, 'access_token', self.access)
-        CredentialsLoader.set_credential(self.CREDENTIALS_BLOCK, 'token_expiration', str(self.timeout))
+        TokenStore.get().save(self.CREDENTIALS_BLOCK, {
+            "access_token": params["access_token"][0], "refresh_token": params["refresh_token"][0],
+            "expires": int(time.time()) + int(params["expires_in"][0])  # [0] quirk of parse_qs
+        })
+
+    def refresh_token(self, token):
+        data = {"grant_type": "refresh_token", "client_id": self.client_id,
+                "client_secret": self.client_secret, "refresh_token": token['refresh_token']}
+        # For some dumb reason, data has to be a string
+        r = requests.post(self.OAUTH_BASE + self.TOKEN_URL, data=data, headers={'User-Agent': consts.user_agent})
+        try:
+            response = r.json()
+        except json.decoder.JSONDecodeError as e:
+            print(r.text)
+            raise
+        # Sometimes (maybe?) Imgur randomly invalidates refresh tokens >:(
+        if r.status_code == 401:
+            raise InvalidRefreshToken
+        return {"access_token": response["access_token"], "refresh_token": response["refresh_token"],
+                "expires": int(time.time()) + response["expires_in"]}
 
     def get_token(self):
-        # If the token has expired, request a new one
-        if self.timeout < int(time.time()):
-            data = {"grant_type": "refresh_token", "client_id": self.client_id,
-                    "client_secret": self.client_secret, "refresh_token": self.refresh}
-            # For some dumb reason, data has to be a string
-            r = requests.post(self.OAUTH_BASE + self.TOKEN_URL, data=data, headers={'User-Agent': consts.user_agent})
-            try:
-                response = r.json()
-            except json.decoder.JSONDecodeError as e:
-                print(r.text)
-                raise
-            # Sometimes (maybe?) Imgur randomly invalidates refresh tokens >:(
-            if r.status_code == 401:
-                raise InvalidRefreshToken
-            self.timeout = int(time.time()) + response["expires_in"]
-            self.access = response["access_token"]
-            self.refresh = response["refresh_token"]
-            CredentialsLoader.set_credential(self.CREDENTIALS_BLOCK, 'access_token', self.access)
-            CredentialsLoader.set_credential(self.CREDENTIALS_BLOCK, 'refresh_token', self.refresh)
-            CredentialsLoader.set_credential(self.CREDENTIALS_BLOCK, 'token_expiration', str(self.timeout))
-        return self.access
+        # Refreshed through the token store so other workers don't refresh it at the same time
+        return TokenStore.get().token(self.CREDENTIALS_BLOCK, self.refresh_token, self.seed)['access_token']
+
+    @staticmethod
+    def check_credits(cost=1):
+        """Turn down low priority calls when credits are running low"""
+        if current_priority() == LOW and not ImgurCredits.allow(LOW, cost):
+            raise RateLimited("Imgur")
 
     def get_request(self, url, params=None):
         # headers = {'Authorization': "Bearer " + self.get_token()}
         headers = {'Authorization': "Client-ID " + self.client_id}
+        self.check_credits()
         r = requests.get(self.API_BASE + url, headers=headers, params=params)
+        ImgurCredits.update(r)
         if r.status_code != 200:
-            raise ImgurFailedRequest
+            raise ImgurFailedRequest(r.status_code)
         return r
 
+    def get_metadata(self, url):
+        """Get an API object's data, remembering it (or that it's gone) for a while"""
+        data = metadata.get(self.API_BASE + url)
+        if data is None:
+            raise ImgurFailedRequest(404)
+        if data is not MISS:
+            return data
+        try:
+            data = self.get_request(url).json()['data']
+        except ImgurFailedRequest as e:
+            if e.status_code == 404:
+                metadata.put(self.API_BASE + url, None)
+            raise
+        metadata.put(self.API_BASE + url, data)
+        return data
+
     def post_request(self, url, data, headers=None, params=None):
         # full_headers = {'Authorization': "Bearer " + self.get_token()}
         full_headers = {'Authorization': "Client-ID " + self.client_id}
         if headers:
             full_headers = {**full_headers, **headers}
+        self.check_credits()
         try:
             r = requests.post(self.API_BASE + url, headers=full_headers, data=data, params=params)
         except Exception as e:
             print(self.API_BASE + url, full_headers, data, params)
             # print(r, r.content)
             raise e
+        ImgurCredits.update(r)
         if r.status_code != 200:
             print(self.API_BASE + url, full_headers, data, params)
             print(r, r.content)
             raise ImgurFailedRequest
         return r
 
+    def post_upload(self, url, fields):
+        """Streamed multipart version of post_request"""
+        headers = {'Authorization': "Client-ID " + self.client_id}
+        self.check_credits(ImgurCredits.UPLOAD_COST)
+        r = multipart_upload(self.SERVICE_NAME, self.API_BASE + url, fields, headers=headers)
+        ImgurCredits.update(r)
+        if r.status_code != 200:
+            print(self.API_BASE + url, headers)
+            print(r, r.content)
+            raise ImgurFailedRequest
+        return r
+
     def options_request(self, url, headers=None):
         full_headers = {'Authorization': "Client-ID " + self.client_id}
         if headers:
             full_headers = {**full_headers, **headers}
         r = requests.options(self.API_BASE + url, headers=full_headers)
+        ImgurCredits.update(r)
         if r.status_code != 200:
             raise ImgurFailedRequest
         return r
 
     def gallery_item(self, id):
-        r = self.get_request(self.GALLERY_ALBUM + id)
-        return r.json()['data']
+        return self.get_metadata(self.GALLERY_ALBUM + id)
 
     def get_album(self, id):
-        r = self.get_request(self.ALBUM + id)
-        return r.json()['data']
+        return self.get_metadata(self.ALBUM + id)
 
     def get_image(self, id):
-        r = self.get_request(self.IMAGE + id)
-        return r.json()['data']
+        return self.get_metadata(self.IMAGE + id)
 
     def upload_image(self, file, media_type, nsfw, audio=False):
         # Attempt upload 3 times
@@ -167,8 +257,7 @@ class ImgurClient:
             data['video'] = ("video." + media_type, file, "video/" + media_type)
             data['name'] = "video." + media_type
             api = self.UPLOAD
-            m = MultipartEncoder(fields=data)
-            r = self.post_request(api, m, {'Content-Type': m.content_type})
+            r = self.post_upload(api, data)
         # We get around the image file size restriction by using a client ID made by a browser
         # Luckily the API is similarish (rather than last time where it wasn't and also 3 steps)
         elif media_type == consts.GIF:
@@ -178,8 +267,7 @@ class ImgurClient:
             r = s.options(self.API_BASE + api, params=params)
             data['image'] = (file.name, file, "image/gif")
             data['name'] = file.name
-            m = MultipartEncoder(fields=data)
-            r = s.post(self.API_BASE + api, headers={'Content-Type': m.content_type}, data=m, params=params)
+            r = multipart_upload(self.SERVICE_NAME, self.API_BASE + api, data, session=s, params=params)
         # pprint(r.json())
         j = r.json()
         if not j['data'].get('id', False):
@@ -190,9 +278,6 @@ class ImgurClient:
         return j['data']['id']
 
 
-imgur = ImgurClient.get()
-
-
 class ImgurGif(Gif):
     process_id = True
 
@@ -208,15 +293,15 @@ class ImgurGif(Gif):
         # Try block for catching imgur 404s
         try:
             if imgur_match[4]:  # Image match
-                self.pic = imgur.get_image(imgur_match[4])
+                self.pic = ImgurClient.get().get_image(imgur_match[4])
             elif imgur_match[3]:  # Gallery match
-                gallery = imgur.gallery_item(imgur_match[3])
+                gallery = ImgurClient.get().gallery_item(imgur_match[3])
                 # if not isinstance(gallery, GalleryImage):
                 self.pic = gallery["images"][0]  # First image from gallery album
                 # else:
                 #     id = gallery.id
             elif imgur_match[2]:  # Album match
-                self.pic = imgur.get_album(imgur_match[2])["images"][0]
+                self.pic = ImgurClient.get().get_album(imgur_match[2])["images"][0]
 
             id = self.pic["id"]
 
@@ -227,9 +312,20 @@ class ImgurGif(Gif):
 
         return id
 
+    def forget(self):
+        if self.id:
+            metadata.discard(ImgurClient.API_BASE + ImgurClient.IMAGE + self.id)
+            self.pic = None
+
     def analyze(self) -> bool:
         """Analyze an imgur gif and determine how to reverse and upload"""
 
+        # Gifs made from a bare id (like ones from the database) haven't been looked up yet
+        if not self.pic and self.id:
+            try:
+                self.pic = ImgurClient.get().get_image(self.id)
+            except ImgurFailedRequest:
+                return False
         if not self.pic:
             return False
         # pprint(self.pic)
@@ -257,20 +353,30 @@ class ImgurGif(Gif):
         print(self.files)
         return True
 
+    def estimate(self):
+        if not self.pic or not self.pic.get('mp4_size', None):
+            return None
+        return self.pic['mp4_size'] / 1000000
+
 
 
 class ImgurHost(GifHost):
     name = "Imgur"
     regex = REPatterns.imgur
+    prefilter = ("imgur.com",)
     url_template = "https://imgur.com/{}.gifv"
     gif_type = ImgurGif
     vid_len_limit = 60
     vid_size_limit = 200
     gif_size_limit = 201
 
+    @classmethod
+    def available(cls):
+        return ImgurCredits.allow(HIGH, ImgurCredits.UPLOAD_COST)
+
     @classmethod
     def upload(cls, file, gif_type, nsfw, audio=False):
-        id = imgur.upload_image(file, gif_type, nsfw=nsfw)
+        id = ImgurClient.get().upload_image(file, gif_type, nsfw=nsfw)
         if id:
             return ImgurGif(cls, id, nsfw=nsfw)
 
@@ -33,6 +33,7 @@ class LinkGif(Gif):
 class LinkGifHost(GifHost):
     name = "LinkGif"
     regex = REPatterns.link_gif
+    prefilter = (".gif",)
     url_template = "{}"
     gif_type = LinkGif
     priority = 10
@@ -3,7 +3,7 @@ from io import BytesIO
 from prawcore.exceptions import ResponseException
 
 from core import constants as consts
-from core.hosts import GifHost, Gif, GifFile
+from core.hosts import GifHost, Gif, GifFile, match_id
 from core.regex import REPatterns
 from core.file import get_duration, get_fps
 from core.concat import concat
@@ -61,54 +61,60 @@ class RedditVid(Gif):
         # self.files.append(GifFile(file, self.host, consts.GIF, self.size))
         return True
 
+    def estimate(self):
+        # The id only leads to a page, the video's size takes a trip through Reddit to find
+        return None
+
 
 class RedditVideoHost(GifHost):
     name = "RedditVideo"
     regex = REPatterns.reddit_vid
+    # Submission links might point to a reddit video
+    prefilter = ("v.redd.it", "reddit.com")
     url_template = "https://v.redd.it/{}"
     gif_type = RedditVid
     can_gif = False
     can_vid = False
 
     @classmethod
-    def get_gif(cls, id=None, regex=None, text=None, **kwargs) -> Gif:
+    def get_gif(cls, id=None, regex=None, text=None, match=None, **kwargs) -> Gif:
         url = None
-        if text:
-            # Parse submission urls
-            subregex = REPatterns.reddit_submission.findall(text)
-            if subregex:
-                if subregex[0][3]:
-                    reddit = cls.ghm.reddit
-                    try:
-                        submission = reddit.submission(subregex[0][3])
-                        regex = cls.regex.findall(submission.url)
-                    except ResponseException:
-                        print("Submission does not exist")
-                        return None
-                    if regex:
-                        # Modify text to be a v.redd.it link for down the line parsing
-                        text = submission.url
-                    else:
-                        # Not a reddit vid
-                        if submission.is_self:      # Selfposts just link to themselves, are not a redirect
-                            return None
-                        return cls.ghm.extract_gif(submission.url, **kwargs)
-            regex = cls.regex.findall(text)
-        if regex:
+        if text and not match and not regex:
+            match = cls.find(text)
+        # Submission links might point to a reddit video
+        if match and match.re is REPatterns.reddit_submission:
+            reddit = cls.ghm.reddit
+            try:
+                submission = reddit.submission(match.group(4))
+                video = cls.regex.search(submission.url)
+            except ResponseException:
+                print("Submission does not exist")
+                return None
+            if not video:
+                # Not a reddit vid
+                if submission.is_self:      # Selfposts just link to themselves, are not a redirect
+                    return None
+                return cls.ghm.extract_gif(submission.url, **kwargs)
+            match = video
+        if match:
+            id = match_id(match)
+        elif regex:
             id = regex[0]
-            # For whatever terrible reason, fullmatch doesn't work with this regex statement. No idea why. God help me
-            # url = cls.regex.fullmatch(text).string
         if id:
             return cls.gif_type(cls, id, url=url, **kwargs)
 
     @classmethod
     def match(cls, text):
-        # print(cls.regex.findall(text), REPatterns.reddit_submission.findall(text))
-        sub = REPatterns.reddit_submission.findall(text)
-        if sub:
-            if sub[0][3]:
-                return True
-        return len(cls.regex.findall(text)) != 0
+        return cls.find(text) is not None
+
+    @classmethod
+    def find(cls, text):
+        """A submission link match if the text has one, otherwise a v.redd.it match"""
+        sub = REPatterns.reddit_submission.search(text)
+        if sub and sub.group(4):
+            return sub
+        return cls.regex.search(text)
+
 
 class RedditGif(Gif):
     def analyze(self) -> bool:
@@ -121,6 +127,7 @@ class RedditGif(Gif):
 class RedditGifHost(GifHost):
     name = "RedditGif"
     regex = REPatterns.reddit_gif
+    prefilter = ("i.redd.it",)
     url_template = "https://i.redd.it/{}.gif"
     gif_type = RedditGif
     can_gif = False
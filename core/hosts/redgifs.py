@@ -22,4 +22,4 @@ class RedgifsHost(GfycatHost):
     vid_len_limit = 61  # This has been double verified now lol
     gif_size_limit = 1700   # Gfycat doesn't have a real limit but I doubt anything higher than this will work
     gif_frame_limit = 2100
-    API = RedgifsClient.get()
+    API_CLIENT = RedgifsClient
@@ -1,13 +1,16 @@
+import os
 import requests
-from requests_toolbelt.multipart.encoder import MultipartEncoder
 from io import BytesIO
 from core.credentials import CredentialsLoader
+from core.cache import metadata, MISS
 from core import constants as consts
 from core.hosts import GifHost, Gif, GifFile
+from core.hosts.upload import multipart_upload
 from core.regex import REPatterns
 
 class StreamableClient:
     instance = None
+    VIDEO_INFO = "https://api.streamable.com/videos/{}"
 
     @classmethod
     def get(cls):
@@ -21,22 +24,28 @@ class StreamableClient:
         self.headers = {'User-Agent': consts.user_agent}
 
     def download_video(self, id):
-        r = requests.get('https://api.streamable.com/videos/{}'.format(id), headers=self.headers, auth=self.auth)
+        url = self.VIDEO_INFO.format(id)
+        info = metadata.get(url)
+        if info is not MISS:
+            return info
+        r = requests.get(url, headers=self.headers, auth=self.auth)
         if r.status_code == 404:
+            metadata.put(url, None)
             return None
-        json = r.json()
-        return r.json()['files']['mp4']
+        info = r.json()['files']['mp4']
+        metadata.put(url, info)
+        return info
 
     def upload_file(self, filestream, title):
         # tries = 3
         # while tries:
-        files = {"file": filestream}
-        data = None
+        filestream.seek(0)
+        fields = {"file": (os.path.basename(getattr(filestream, 'name', "video.mp4")), filestream)}
         if title:
-            data = {'title': title}
-        # m = MultipartEncoder(fields=files)
+            fields['title'] = title
         print("Uploading to streamable...")
-        r = requests.post('https://api.streamable.com/upload', headers=self.headers, files=files, data=data, auth=self.auth)
+        r = multipart_upload("Streamable", 'https://api.streamable.com/upload', fields, headers=self.headers,
+                             auth=self.auth)
         if r.text:
             return r.json()['shortcode']
 
@@ -44,11 +53,12 @@ class StreamableClient:
         r = requests.get('https://api.streamable.com/import', headers=self.headers, params={'url': link, 'title': title}, auth=self.auth)
         print(r.text)
 
-streamable = StreamableClient()
-
 class StreamableGif(Gif):
+    def forget(self):
+        metadata.discard(StreamableClient.VIDEO_INFO.format(self.id))
+
     def analyze(self):
-        info = streamable.download_video(self.id)
+        info = StreamableClient.get().download_video(self.id)
         if not info:
             return False
         file = BytesIO(requests.get(info['url']).content)
@@ -56,10 +66,17 @@ class StreamableGif(Gif):
                                   size=info['size']/1000000))
         return True
 
+    def estimate(self):
+        info = StreamableClient.get().download_video(self.id)
+        if not info:
+            return None
+        return info['size'] / 1000000
+
 
 class StreamableHost(GifHost):
     name = "Streamable"
     regex = REPatterns.streamable
+    prefilter = ("streamable.com",)
     url_template = "https://streamable.com/{}"
     audio = True
     gif_type = StreamableGif
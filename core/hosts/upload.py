@@ -0,0 +1,57 @@
+import time
+from collections import defaultdict, deque
+import requests
+from requests_toolbelt.multipart.encoder import MultipartEncoder, MultipartEncoderMonitor
+
+"""Every host uploads through here. Bodies are streamed straight from the file in small reads instead of being built in
+memory, and the transfer rate of each upload is recorded per host"""
+
+HISTORY = 50    # Uploads kept per host for throughput stats
+# Seconds to connect and to go without hearing back, so a stalled upload fails instead of hanging
+TIMEOUT = (15, 5 * 60)
+
+
+class UploadStats:
+    # Host name: deque of (bytes, seconds)
+    uploads = defaultdict(lambda: deque(maxlen=HISTORY))
+
+    @classmethod
+    def record(cls, host, size, seconds):
+        cls.uploads[host].append((size, seconds))
+
+    @classmethod
+    def throughput(cls, host):
+        """Average bytes/sec over the recent uploads to a host, None if there haven't been any"""
+        uploads = cls.uploads.get(host, None)
+        if not uploads:
+            return None
+        seconds = sum(s for b, s in uploads)
+        return sum(b for b, s in uploads) / seconds if seconds else None
+
+    @classmethod
+    def summary(cls):
+        return {host: {"uploads": len(uploads), "bytes_per_sec": cls.throughput(host)}
+                for host, uploads in cls.uploads.items()}
+
+
+def multipart_upload(host, url, fields, headers=None, session=None, **kwargs):
+    """
+    POST a multipart form, streaming any files in it
+    :param host: name of the host, for stats
+    :param url: url to post to
+    :param fields: form fields, files are (filename, filestream, mimetype) tuples
+    :param headers: extra headers, the content type is filled in
+    :param session: requests session to post with
+    :return: the response, raises requests.Timeout if the host stops responding
+    """
+    encoder = MultipartEncoder(fields=fields)
+    monitor = MultipartEncoderMonitor(encoder)
+    headers = {**(headers or {}), 'Content-Type': monitor.content_type}
+    start = time.perf_counter()
+    kwargs.setdefault('timeout', TIMEOUT)
+    r = (session or requests).post(url, data=monitor, headers=headers, **kwargs)
+    seconds = time.perf_counter() - start
+    UploadStats.record(host, monitor.bytes_read, seconds)
+    print("Sent {:.2f}MB to {} in {:.1f}s ({:.2f}MB/s)".format(monitor.bytes_read / 1000000, host, seconds,
+                                                               monitor.bytes_read / 1000000 / seconds if seconds else 0))
+    return r
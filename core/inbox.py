@@ -0,0 +1,72 @@
+import time
+import threading
+from collections import deque
+from core import constants as consts
+from core.requestor import RateBudget
+
+"""Decides how long to wait between inbox checks. Right after a summon comes in, more tend to follow, so the inbox is
+checked again quickly and the wait doubles every time it comes up empty until it's back to the normal sleep time.
+Checks are spread out further if they'd eat into the rate limit that requests need"""
+
+FASTEST = 5                     # Seconds between checks right after activity
+SLOWEST = consts.sleep_time     # Seconds between checks when it's quiet
+BACKOFF = 2
+RESERVE = 60                    # Rate limit calls left for processing requests
+LATENCY_HISTORY = 500
+
+
+class PollScheduler:
+    def __init__(self, fastest=FASTEST, slowest=SLOWEST):
+        self.fastest = fastest
+        self.slowest = slowest
+        self.interval = slowest
+
+    def next_wait(self, activity, failure=False):
+        """
+        How long to sleep before checking the inbox again
+        :param activity: whether the last check found anything
+        :param failure: whether an upload failed, in which case there's no point hurrying back
+        """
+        if failure:
+            self.interval = self.slowest
+        elif activity:
+            self.interval = self.fastest
+        else:
+            self.interval = min(self.interval * BACKOFF, self.slowest)
+        return max(self.interval, self.budget_wait())
+
+    @staticmethod
+    def budget_wait():
+        """The shortest wait that leaves the reserve alone until the rate limit resets"""
+        if RateBudget.remaining is None:
+            return 0
+        spare = RateBudget.remaining - RESERVE
+        if spare < 1:
+            return RateBudget.seconds_to_reset()
+        return RateBudget.seconds_to_reset() / spare
+
+
+class ReplyLatency:
+    """Seconds from a summon being posted to our reply"""
+    latencies = deque(maxlen=LATENCY_HISTORY)
+    lock = threading.Lock()
+
+    @classmethod
+    def record(cls, comment):
+        with cls.lock:
+            cls.latencies.append(time.time() - comment.created_utc)
+
+    @classmethod
+    def percentile(cls, p):
+        with cls.lock:
+            ordered = sorted(cls.latencies)
+        if not ordered:
+            return None
+        return ordered[min(int(len(ordered) * p), len(ordered) - 1)]
+
+    @classmethod
+    def summary(cls):
+        if not cls.latencies:
+            return "No replies yet"
+        return "Reply latency p50 {:.1f}s p95 {:.1f}s over {} replies".format(cls.percentile(.5), cls.percentile(.95),
+                                                                               len(cls.latencies))
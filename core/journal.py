@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+from core.credentials import CredentialsLoader
+
+"""Append only record of how far each request has gotten, so a crash doesn't mean reversing and uploading everything
+again. Every stage is written and synced to journal.jsonl before moving on, reversed files are copied into a spool
+folder until they've been uploaded. On restart, requests that were uploaded but never replied to are finished off and
+anything still reversed on disk is uploaded from the spool instead of being reversed again. Finished requests are kept
+until they're MAX_AGE old too, since their summons can still be unread and would otherwise be answered twice"""
+
+RECEIVED = "received"
+DOWNLOADED = "downloaded"
+REVERSED = "reversed"
+UPLOADED = "uploaded"
+ENCODING = "encoding"   # Uploaded but the host is still encoding it
+REPLIED = "replied"
+FAILED = "failed"
+FINISHED = (REPLIED, FAILED)
+
+MAX_AGE = 2 * 24 * 60 * 60      # Requests older than this are dropped
+COMPACT_EVERY = 1000            # Finished requests between rewrites of the journal
+
+
+class Journal:
+    instance = None
+
+    def __init__(self, path=None):
+        root = os.path.dirname(os.path.abspath(CredentialsLoader.path))
+        self.path = path or os.path.join(root, "journal.jsonl")
+        self.spool_dir = os.path.join(os.path.dirname(self.path), "spool")
+        self.lock = threading.Lock()
+        # Request: merged state from all of its entries
+        self.states = None
+        self.finished = 0
+        self.compacted = False
+
+    @classmethod
+    def get(cls):
+        if not cls.instance:
+            cls.instance = cls()
+        return cls.instance
+
+    def _load(self):
+        if self.states is not None:
+            return
+        self.states = {}
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Half written line from a crash
+                        continue
+                    self.states[entry['request']] = {**self.states.get(entry['request'], {}), **entry}
+        except FileNotFoundError:
+            pass
+
+    def record(self, request, stage, **data):
+        entry = {"request": request, "stage": stage, "time": time.time(), **data}
+        line = json.dumps(entry) + "\n"
+        with self.lock:
+            self._load()
+            with open(self.path, "a") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self.states[request] = {**self.states.get(request, {}), **entry}
+            if stage in FINISHED:
+                self.finished += 1
+        if stage in FINISHED:
+            self.unspool(self.states[request])
+
+    def state(self, request):
+        with self.lock:
+            self._load()
+            return self.states.get(request, None)
+
+    def unfinished(self):
+        with self.lock:
+            self._load()
+            return [state for state in self.states.values() if state['stage'] not in FINISHED]
+
+    def tidy(self):
+        """Compact the journal once at startup and then every so often. Only call it after the inbox has been checked
+        against the journal and the summons it finished have been marked read"""
+        if not self.compacted or self.finished >= COMPACT_EVERY:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the journal with only the requests from the last MAX_AGE"""
+        with self.lock:
+            self._load()
+            cutoff = time.time() - MAX_AGE
+            keep = {}
+            for request, state in self.states.items():
+                if state['time'] < cutoff:
+                    self.unspool(state)
+                    continue
+                keep[request] = state
+            fd, temp = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix=".journal")
+            with os.fdopen(fd, "w") as f:
+                for state in keep.values():
+                    f.write(json.dumps(state) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, self.path)
+            self.states = keep
+            self.finished = 0
+            self.compacted = True
+
+    def spool(self, request, file, extension):
+        """Keep a copy of a reversed file until it's uploaded, returns its path"""
+        os.makedirs(self.spool_dir, exist_ok=True)
+        path = os.path.join(self.spool_dir, "{}.{}".format(request, extension))
+        file.seek(0)
+        with open(path + ".part", "wb") as f:
+            shutil.copyfileobj(file, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".part", path)
+        file.seek(0)
+        return path
+
+    @staticmethod
+    def unspool(state):
+        path = state.get('spool', None)
+        if path and os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,41 @@
+import time
+import threading
+
+"""The subreddits the bot moderates, kept in memory so AutoModerator summons don't page through the whole list from
+Reddit every time. It's reloaded every so often to catch being removed as a mod"""
+
+REFRESH = 60 * 60
+
+
+class ModeratedSubreddits:
+    instance = None
+
+    def __init__(self, reddit):
+        self.reddit = reddit
+        # Lowercase display names
+        self.names = set()
+        self.loaded = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get(cls, reddit):
+        if not cls.instance:
+            cls.instance = cls(reddit)
+        return cls.instance
+
+    def refresh(self):
+        names = {subreddit.display_name.lower() for subreddit in self.reddit.user.me().moderated()}
+        with self.lock:
+            self.names = names
+            self.loaded = time.time()
+        print("Moderating {} subreddits".format(len(names)))
+
+    def add(self, name):
+        """Called when we accept an invite so we don't have to wait for the next refresh"""
+        with self.lock:
+            self.names.add(name.lower())
+
+    def __contains__(self, name):
+        if time.time() - self.loaded > REFRESH:
+            self.refresh()
+        return name.lower() in self.names
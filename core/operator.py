@@ -1,6 +1,67 @@
 from praw.models import Redditor
 import core.constants as consts
+from core.budget import ActionScheduler, NOTIFY
+import re
 import json
+import threading
+from collections import OrderedDict
+
+DIGEST_WINDOW = 5 * 60  # Notifications are collected for this long and sent together
+MAX_EXAMPLES = 3        # Copies of a repeated notification to include in a digest
+MAX_LENGTH = 9500       # Reddit's PM limit is 10000
+
+numbers = re.compile(r"\d+(\.\d+)?")
+
+
+class Notifier:
+    """Collects operator notifications and sends them as one digest, with repeats of the same notification counted
+    instead of sent again. Anything waiting gets sent when the ActionScheduler is flushed on shutdown or a crash"""
+    instance = None
+
+    def __init__(self):
+        # (subject, template): {"subject", "count", "examples"}
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+        self.scheduled = False
+
+    @classmethod
+    def get(cls):
+        if not cls.instance:
+            cls.instance = cls()
+        return cls.instance
+
+    def add(self, subject, message, template=None):
+        # Notifications that only differ by numbers count as repeats
+        key = (subject, numbers.sub("#", template or message))
+        with self.lock:
+            entry = self.pending.setdefault(key, {"subject": subject, "count": 0, "examples": []})
+            entry["count"] += 1
+            if len(entry["examples"]) < MAX_EXAMPLES:
+                entry["examples"].append(message)
+            if not self.scheduled:
+                self.scheduled = True
+                ActionScheduler.get().submit(NOTIFY, self.send, "operator digest", DIGEST_WINDOW)
+
+    def send(self):
+        with self.lock:
+            entries = list(self.pending.values())
+            self.pending.clear()
+            self.scheduled = False
+        if not entries:
+            return
+        if len(entries) == 1 and entries[0]["count"] == 1:
+            subject, body = entries[0]["subject"], entries[0]["examples"][0]
+        else:
+            subject = "{} notifications".format(sum(entry["count"] for entry in entries))
+            sections = []
+            for entry in entries:
+                repeats = " (x{})".format(entry["count"]) if entry["count"] > 1 else ""
+                sections.append("**{}**{}\n\n{}".format(entry["subject"], repeats,
+                                                        "\n\n".join(entry["examples"])))
+            body = "\n\n---\n\n".join(sections)
+        if len(body) > MAX_LENGTH:
+            body = body[:MAX_LENGTH] + "\n\n(cut off)"
+        Operator.user.message(consts.short_name + " - " + subject, body)
 
 
 class Operator:
@@ -18,9 +79,10 @@ class Operator:
         return cls.__new__(cls)
 
     @classmethod
-    def message(cls, message, subject="Notification", print_message=True, always_message=False):
+    def message(cls, message, subject="Notification", print_message=True, always_message=False, template=None):
         if not cls.testing or always_message:
-            cls.user.message(consts.short_name + " - " + subject, message)
+            # Sent in the background as part of a digest
+            Notifier.get().add(subject, message, template)
         if print_message:
             print(message)
 
@@ -30,7 +92,8 @@ class Operator:
             pretty_data = json.dumps(cls.data, indent=4).replace("\n", "\n    ")
         else:
             pretty_data = "No Data"
-        cls.message(f"{message}\n\n---\n\nRequest Data:\n\n    {pretty_data}", subject, False, always_message)
+        cls.message(f"{message}\n\n---\n\nRequest Data:\n\n    {pretty_data}", subject, False, always_message,
+                    template=message)
         if print_message:
             print(message)
 
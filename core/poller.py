@@ -0,0 +1,103 @@
+import heapq
+import itertools
+import threading
+import time
+import traceback
+from collections import deque
+from core.hosts import PendingUpload, UploadFailed
+
+"""Hosts like Gfycat encode uploads on their side, which can take up to an hour. Rather than having a request wait on
+that, their uploads are handed off here and a single thread checks on all of them with a backoff. Finished ones are
+only queued up by that thread, their callbacks reply on Reddit so the main loop runs them through drain"""
+
+FIRST_CHECK = 7     # Seconds before the first check
+MAX_WAIT = 60       # Longest wait between checks
+BACKOFF = 1.5
+ENCODE_TIMEOUT = 3200
+
+
+class EncodePoller:
+    instance = None
+
+    def __init__(self):
+        # Heap of (next check time, tiebreaker, current wait, PendingUpload)
+        self.pending = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+        # (PendingUpload, uploaded Gif or None if it failed) waiting for drain
+        self.finished = deque()
+
+    @classmethod
+    def get(cls):
+        # An empty poller is falsy
+        if cls.instance is None:
+            cls.instance = cls()
+        return cls.instance
+
+    def add(self, pending: PendingUpload):
+        with self.condition:
+            heapq.heappush(self.pending, (time.time() + FIRST_CHECK, next(self.counter), FIRST_CHECK, pending))
+            self.condition.notify()
+            if not self.thread or not self.thread.is_alive():
+                self.running = True
+                self.thread = threading.Thread(target=self._run, name="EncodePoller", daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def __len__(self):
+        return len(self.pending) + len(self.finished)
+
+    def watching(self, ticket):
+        """Whether an upload is still being checked on or waiting for drain"""
+        with self.condition:
+            return any(entry[3].ticket == ticket for entry in self.pending) or \
+                any(pending.ticket == ticket for pending, result in self.finished)
+
+    def drain(self):
+        """Run the callbacks of every upload that finished since the last drain, from the caller's thread"""
+        while self.finished:
+            pending, result = self.finished.popleft()
+            try:
+                if result:
+                    pending.done(result)
+                else:
+                    pending.failed()
+            except Exception:
+                # Don't let one bad callback take down every other upload
+                traceback.print_exc()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and (not self.pending or self.pending[0][0] > time.time()):
+                    self.condition.wait(self.pending[0][0] - time.time() if self.pending else None)
+                if not self.running:
+                    return
+                due, i, wait, pending = heapq.heappop(self.pending)
+            self._check(pending, wait)
+
+    def _check(self, pending, wait):
+        try:
+            result = pending.check()
+        except Exception:
+            # Probably a connection problem, try again later
+            traceback.print_exc()
+            result = None
+        if result is UploadFailed:
+            self.finished.append((pending, None))
+        elif result:
+            print("Finished encoding", pending, "after", pending.checks, "checks")
+            self.finished.append((pending, result))
+        elif time.time() - pending.started > ENCODE_TIMEOUT:
+            print("Encode timed out", pending)
+            self.finished.append((pending, None))
+        else:
+            wait = min(wait * BACKOFF, MAX_WAIT)
+            with self.condition:
+                heapq.heappush(self.pending, (time.time() + wait, next(self.counter), wait, pending))
@@ -0,0 +1,119 @@
+import time
+from math import log, exp
+from collections import defaultdict
+from core import constants as consts
+from core.file import estimate_frames_to_gif
+
+"""Predicts how big a reversed file will be before encoding it so we can pick a host and format that will accept it.
+The model is a log-linear fit of output size against pixel-frames and source bitrate, calibrated per encoder profile
+from the EncodeStats history"""
+
+GIFSKI = "gifski"
+MIN_SAMPLES = 20        # Minimum encodes before we trust a fit
+HISTORY_SIZE = 5000     # How many recent encodes to calibrate from
+RECALIBRATE = 6 * 60 * 60
+
+
+def _solve(a, b):
+    """Solve a small linear system with Gaussian elimination"""
+    n = len(b)
+    m = [row[:] + [b[i]] for i, row in enumerate(a)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(m[r][col]))
+        m[col], m[pivot] = m[pivot], m[col]
+        if abs(m[col][col]) < 1e-12:
+            return None
+        for r in range(n):
+            if r != col:
+                factor = m[r][col] / m[col][col]
+                m[r] = [x - factor * y for x, y in zip(m[r], m[col])]
+    return [m[i][n] / m[i][i] for i in range(n)]
+
+
+def _features(width, height, frames, bitrate):
+    return [1.0, log(max(width * height * frames, 1)), log(max(bitrate, 0.001))]
+
+
+class SizeModel:
+    def __init__(self, rows):
+        """Least squares fit of log(output size) over the features"""
+        x = [_features(r['width'], r['height'], r['frames'], r['source_bitrate']) for r in rows]
+        y = [log(max(r['output_size'], 0.001)) for r in rows]
+        k = len(x[0])
+        # Tiny ridge term keeps this solvable when every sample is the same resolution
+        xtx = [[sum(row[i] * row[j] for row in x) + (1e-6 if i == j else 0) for j in range(k)] for i in range(k)]
+        xty = [sum(row[i] * t for row, t in zip(x, y)) for i in range(k)]
+        self.coefficients = _solve(xtx, xty)
+        self.samples = len(rows)
+        if self.coefficients:
+            residuals = [t - self._log_predict(row) for row, t in zip(x, y)]
+            self.error = (sum(r * r for r in residuals) / len(residuals)) ** .5
+        else:
+            self.error = None
+
+    def _log_predict(self, features):
+        return sum(c * f for c, f in zip(self.coefficients, features))
+
+    def predict(self, width, height, frames, bitrate):
+        return exp(self._log_predict(_features(width, height, frames, bitrate)))
+
+
+class SizePredictor:
+    instance = None
+
+    def __init__(self):
+        self.models = {}
+        self.calibrated = 0
+
+    @classmethod
+    def get(cls):
+        if not cls.instance:
+            cls.instance = cls()
+        return cls.instance
+
+    def calibrate(self, rows=None):
+        """Fit a model per encoder profile and one per output type as a fallback"""
+        if rows is None:
+            # Imported here since history depends on the gif host manager
+            from core.history import list_encode_stats
+            rows = list_encode_stats(HISTORY_SIZE)
+        groups = defaultdict(list)
+        for row in rows:
+            groups[row['profile']].append(row)
+            groups[row['output_type']].append(row)
+        self.models = {}
+        for key, group in groups.items():
+            if len(group) >= MIN_SAMPLES:
+                model = SizeModel(group)
+                if model.coefficients:
+                    self.models[key] = model
+        self.calibrated = time.time()
+        print("Calibrated size predictor", {k: (m.samples, round(m.error, 3)) for k, m in self.models.items()})
+
+    def predict(self, gif_file, output_type, profile=None, scale=1.0, fps_factor=1.0):
+        """
+        Estimate the size of a reversed file in MB
+        :param gif_file: GifFile being reversed
+        :param output_type: type of the reversed file
+        :param profile: name of the encoder profile, gifski for gifs
+        :param scale: predict for the video scaled by this much on each side
+        :param fps_factor: predict for the video with its frame rate reduced by this much
+        :return: size in MB, or None if the file has no video info
+        """
+        if time.time() - self.calibrated > RECALIBRATE:
+            self.calibrate()
+        info = gif_file.info
+        if not info.video or not info.fps:
+            return None
+        width, height = info.dimensions[0] * scale, info.dimensions[1] * scale
+        frames = (info.frame_count or round(info.duration * info.fps)) * fps_factor
+        bitrate = gif_file.size * 8 / info.duration if info.duration else 0
+        if output_type == consts.GIF:
+            profile = GIFSKI
+        model = self.models.get(profile, self.models.get(output_type, None))
+        if model:
+            return model.predict(width, height, frames, bitrate)
+        # Uncalibrated guesses
+        if output_type == consts.GIF:
+            return estimate_frames_to_gif(width, height, frames)
+        return gif_file.size * scale ** 2 * fps_factor
@@ -1,25 +1,74 @@
+import os
+import traceback
 from io import BytesIO
 import praw.exceptions
 from core.context import CommentContext
 from core.reply import reply
 from core.gif import GifHostManager
 from core.reverse import reverse_mp4, reverse_gif
-from core.history import check_database, add_to_database, delete_from_database
+from core.encoders import get_profile
+from core.history import check_database, add_to_database, delete_from_database, add_encode_stats, add_fit_stats
+from core.fit import fit_to_host, needs_fit, predict_fit
+from core.admission import Admission, estimate
+from core.credentials import CredentialsLoader
+from core.predict import GIFSKI
 from core import constants as consts
-from core.hosts import GifFile, Gif, UploadFailed, CannotUpload
-from core.constants import SUCCESS, USER_FAILURE, UPLOAD_FAILURE
+from core.hosts import GifFile, Gif, UploadFailed, CannotUpload, PendingUpload, RateLimited, low_priority
+from core.poller import EncodePoller
+from core.hedge import hedged_upload
+from core.health import monitored_upload
+from core.constants import SUCCESS, USER_FAILURE, UPLOAD_FAILURE, PENDING
 from core.operator import Operator
+from core.moderated import ModeratedSubreddits
+from core.journal import Journal, RECEIVED, DOWNLOADED, REVERSED, UPLOADED, ENCODING, REPLIED, FAILED
+from core.trace import Tracer, span, traced
+from core.budget import REPLY, held
+
+RESULT_NAMES = {SUCCESS: "success", USER_FAILURE: "user_failure", UPLOAD_FAILURE: "upload_failure",
+                PENDING: "pending"}
+MAX_ENCODE_FAILURES = 4     # Failed encodes before giving up on a request
 
 
 def process_comment(reddit, comment=None, queue=None, original_context=None):
+    Tracer.get().begin((comment or original_context.comment).fullname)
+    with span("process_comment") as entry:
+        result, context, original_gif = prepare_request(reddit, comment, queue, original_context)
+        if result is None:
+            result = reverse_request(reddit, context, original_gif)
+        entry["outcome"] = RESULT_NAMES.get(result)
+    return result
+
+
+@traced("prepare", outcome=lambda result: RESULT_NAMES.get(result[0], "reverse"))
+def prepare_request(reddit, comment=None, queue=None, original_context=None):
+    """The cheap part of a request, finding the gif and answering rereverses and reverses we already have. Returns the
+    result if that finished it, otherwise None with the context and gif that need reversing"""
+    # Don't spend calls on summons we can't reply to yet, they stay unread until then
+    if held(REPLY):
+        print("Replies are rate limited for another {:.0f}s, leaving the summon for later".format(held(REPLY)))
+        return PENDING, None, None
     ghm = GifHostManager(reddit)
+    journal = Journal.get()
     if not original_context:  # If we were not provided context, make our own
+        # Don't redo a request that got far enough before a restart
+        previous = journal.state(comment.fullname)
+        if previous:
+            if previous['stage'] == REPLIED:
+                print("Already replied to", comment.fullname)
+                return SUCCESS, None, None
+            elif previous['stage'] == FAILED:
+                return USER_FAILURE, None, None
+            elif in_progress(previous):
+                return PENDING, None, None
+            elif previous['stage'] in (UPLOADED, ENCODING):
+                return resume_request(reddit, previous), None, None
+
         # Check if comment is deleted
         try:
             if not comment.author:
                 print("Comment doesn't exist????")
                 print(vars(comment))
-                return USER_FAILURE
+                return USER_FAILURE, None, None
         except praw.exceptions.PRAWException as e:
             # Operator.instance().message(str(vars(comment)) + " " + str(vars(e)), "Funny business")
             # print(e)
@@ -27,7 +76,7 @@ def process_comment(reddit, comment=None, queue=None, original_context=None):
             # removed. However, it seems that this happens when the comment is too new for Reddit to
             # return any data on it. So if we mark it as an UPLOAD_FAILURE, we should be able to return
             # to it later and it should work then???
-            return UPLOAD_FAILURE
+            return UPLOAD_FAILURE, None, None
 
         print("New request by " + comment.author.name)
 
@@ -37,11 +86,10 @@ def process_comment(reddit, comment=None, queue=None, original_context=None):
         Operator.set_request_info(context.to_json())
         if not context.url:  # Did our search return nothing?
             print("Didn't find a URL")
-            return USER_FAILURE
+            return USER_FAILURE, None, None
 
         if context.rereverse and not context.reupload:  # Is the user asking to rereverse?
-            reply(context, context.url)
-            return SUCCESS
+            return replied(reply(context, context.url)), None, None
 
     else:  # If we are the client, context is provided to us
         context = original_context
@@ -59,7 +107,7 @@ def process_comment(reddit, comment=None, queue=None, original_context=None):
     #     return USER_FAILURE
 
     if not new_original_gif:
-        return USER_FAILURE
+        return USER_FAILURE, None, None
 
     # If the gif was unable to be acquired, return
     # original_gif = gif_host.get_gif()
@@ -67,13 +115,13 @@ def process_comment(reddit, comment=None, queue=None, original_context=None):
     #     return USER_FAILURE
 
     if not new_original_gif.id:
-        return USER_FAILURE
+        return USER_FAILURE, None, None
 
     if queue:
         # Add to queue
         print("Adding to queue...")
         queue.add_job(context.to_json(), new_original_gif)
-        return SUCCESS
+        return SUCCESS, None, None
 
     # Check database for gif before we reverse it
     gif = check_database(new_original_gif)
@@ -87,9 +135,8 @@ def process_comment(reddit, comment=None, queue=None, original_context=None):
             print("Doing a reupload check...")
             if not is_reupload_needed(reddit, gif):
                 # No reupload needed, do normal stuff
-                reply(context, gif)
                 print("No reupload needed")
-                return SUCCESS
+                return replied(reply(context, gif)), None, None
             else:
                 # Reupload is needed, delete this from the database
                 delete_from_database(gif)
@@ -97,9 +144,16 @@ def process_comment(reddit, comment=None, queue=None, original_context=None):
         # Proceed as normal
         else:
             # If it was in the database, reuse it
-            reply(context, gif)
-            return SUCCESS
+            return replied(reply(context, gif)), None, None
+
+    return None, context, new_original_gif
 
+
+@traced("reverse_request", outcome=RESULT_NAMES.get)
+def reverse_request(reddit, context, new_original_gif):
+    """The expensive part of a request, downloading, reversing and uploading the gif"""
+    ghm = GifHostManager(reddit)
+    journal = Journal.get()
     # Analyze how the gif should be reversed
     # in_format, out_format = gif_host.analyze()
 
@@ -107,8 +161,30 @@ def process_comment(reddit, comment=None, queue=None, original_context=None):
     # if not in_format or not out_format:
     #     return USER_FAILURE
 
-    if not new_original_gif.analyze():
+    hedge_deadline = float(CredentialsLoader.get_credentials()['general'].get('hedge_deadline', 0))
+    request = context.comment.fullname
+    previous = journal.state(request)
+    # If it was already reversed (before a restart or a failed encode), try uploading that first
+    if previous and previous['stage'] == REVERSED and os.path.exists(previous['spool']):
+        print("Uploading the reverse from before")
+        reversed_gif_file = spooled_file(previous, new_original_gif)
+        result = upload_reverse(ghm, new_original_gif, reversed_gif_file, hedge_deadline)
+        if isinstance(result, PendingUpload):
+            wait_for_encode(context, new_original_gif, result)
+            return PENDING
+        elif result and result is not UploadFailed and result is not CannotUpload:
+            return replied(finish_request(context, new_original_gif, result))
+        # Otherwise start over
+    journal.record(request, RECEIVED, context=context.to_json(), origin_host=new_original_gif.host.name,
+                   origin_id=new_original_gif.id, nsfw=bool(new_original_gif.nsfw))
+
+    with span("analyze", host=new_original_gif.host.name) as entry:
+        analyzed = new_original_gif.analyze()
+        entry["outcome"] = "ok" if analyzed else "failed"
+        entry["bytes_in"] = sum(file.size for file in new_original_gif.files if file.size) * 1000000
+    if not analyzed:
         return USER_FAILURE
+    journal.record(request, DOWNLOADED)
 
     uploaded_gif = None
 
@@ -118,6 +194,15 @@ def process_comment(reddit, comment=None, queue=None, original_context=None):
     # Try every option we have for reversing a gif
     options = ghm.get_upload_host(new_original_gif)
 
+    # Shrink reverses that are too big for a host instead of failing them
+    general = CredentialsLoader.get_credentials()['general']
+    fitting = general.get('fit_to_host', "false").lower() == "true"
+    # Same for reverses too big for this machine
+    fitting_machine = general.get('fit_to_machine', "false").lower() == "true"
+    admission = Admission.get()
+    if not options and fitting:
+        options = ghm.get_upload_host(new_original_gif, fitting=True)
+
     if not options:
         print("File too large {}s {}MB".format(new_original_gif.files[0].duration, new_original_gif.files[0].size))
         cant_upload = True
@@ -137,76 +222,229 @@ def process_comment(reddit, comment=None, queue=None, original_context=None):
 
         r = original_gif_file.file
 
-        # Reverse it as a GIF
-        if original_gif_file.type == consts.GIF:
-            # With reversed gif
-            f = reverse_gif(original_gif_file, format=original_gif_file.type)
-            # Give to gif_host's uploader
-            reversed_gif_file = GifFile(f, original_gif_file.host, consts.GIF,
-                                        duration=original_gif_file.duration, frames=original_gif_file.frames)
-            # reversed_gif = upload_gif_host.upload(f, consts.GIF, new_original_gif.context.nsfw)
-        # Reverse it as a video
-        else:
-            f = reverse_mp4(r, original_gif_file.audio, format=original_gif_file.type,
-                            output=upload_gif_host.video_type)
-            if isinstance(f, list):
+        fit = None
+        if fitting:
+            predicted = ghm.predict_size(original_gif_file, upload_gif_host)
+            if needs_fit(original_gif_file, upload_gif_host, predicted):
+                fit = fit_to_host(original_gif_file, upload_gif_host)
+                if not fit:
+                    print("Couldn't find a way to fit the reverse into", upload_gif_host)
+                    cant_upload = True
+                    continue
+                print("Fitting reverse to", upload_gif_host, fit)
+
+        # Make sure the machine has room for it
+        needs = estimate(original_gif_file, fit)
+        if not admission.fits(needs):
+            shrunk = admission.shrink(original_gif_file, fit) if fitting_machine else None
+            if not shrunk:
+                print("Too big to reverse on this machine ({})".format(needs))
                 Operator.instance().message(
-                    "It appears the video was too big to be reversed\n\n{} from {} {}{} {}"
-                        .format(new_original_gif.url, comment.author, "NSFW " if context.nsfw else "", *f),
+                    "It appears the video was too big to reverse on this machine\n\n{} from {} {}({})"
+                        .format(new_original_gif.url, context.comment.author, "NSFW " if context.nsfw else "",
+                                needs),
                     "Notification")
-                cant_upload = False
-                return USER_FAILURE
-            reversed_gif_file = GifFile(f, original_gif_file.host, upload_gif_host.video_type,
-                                        duration=original_gif_file.duration, audio=original_gif_file.audio)
+                cant_upload = True
+                continue
+            print("Shrinking reverse to fit this machine", shrunk)
+            # Predicted so it shows up in the fit stats like host fits do
+            shrunk.predicted = predict_fit(original_gif_file, upload_gif_host, shrunk)
+            fit = shrunk
+            needs = estimate(original_gif_file, fit)
+
+        with admission.admit(needs):
+            # Reverse it as a GIF
+            if original_gif_file.type == consts.GIF:
+                # With reversed gif
+                f = reverse_gif(original_gif_file, format=original_gif_file.type, fit=fit)
+                # Give to gif_host's uploader
+                reversed_gif_file = GifFile(f, original_gif_file.host, consts.GIF,
+                                            duration=original_gif_file.duration,
+                                            frames=0 if fit else original_gif_file.frames)
+                if not fit:
+                    add_encode_stats(original_gif_file, reversed_gif_file, GIFSKI)
+                # reversed_gif = upload_gif_host.upload(f, consts.GIF, new_original_gif.context.nsfw)
+            # Reverse it as a video
+            else:
+                profile = get_profile(upload_gif_host, getattr(original_gif_file.info, "dimensions", None))
+                f = reverse_mp4(r, original_gif_file.audio, format=original_gif_file.type,
+                                output=upload_gif_host.video_type, profile=profile, fit=fit)
+                if isinstance(f, list):
+                    Operator.instance().message(
+                        "It appears the video was too big to be reversed\n\n{} from {} {}{} {}"
+                            .format(new_original_gif.url, context.comment.author, "NSFW " if context.nsfw else "",
+                                    *f),
+                        "Notification")
+                    cant_upload = False
+                    return USER_FAILURE
+                reversed_gif_file = GifFile(f, original_gif_file.host, upload_gif_host.video_type,
+                                            duration=original_gif_file.duration, audio=original_gif_file.audio)
+                if not fit:
+                    add_encode_stats(original_gif_file, reversed_gif_file, profile.name)
+        # Fits without a prediction have nothing to check it against
+        if fit and fit.predicted:
+            add_fit_stats(upload_gif_host, fit, reversed_gif_file)
             # reversed_gif = upload_gif_host.upload(f, upload_gif_host.video_type, new_original_gif.context.nsfw)
-
-        # Attempt a first upload
-        options = ghm.get_upload_host(new_original_gif, file=reversed_gif_file)
-        # If there was no suitable upload host, this format cannot be uploaded
-        if not options:
+        journal.record(request, REVERSED, spool=journal.spool(request, reversed_gif_file.file, reversed_gif_file.type),
+                       type=reversed_gif_file.type, duration=reversed_gif_file.duration,
+                       audio=bool(reversed_gif_file.audio))
+        # Upload the request's own copy, the next reverse reuses the temp file while losing hedged uploads read it
+        reversed_gif_file = spooled_file(journal.state(request), new_original_gif)
+
+        result = upload_reverse(ghm, new_original_gif, reversed_gif_file, hedge_deadline)
+        # If the host simply cannot accept this file at all
+        if result == CannotUpload:
             cant_upload = True
             continue
-
-        # Using the provided host, perform the upload
-        for i in range(2):
-            result = options[0]['hosts'][0].upload(reversed_gif_file.file, reversed_gif_file.type,
-                                                   new_original_gif.nsfw, reversed_gif_file.audio)
-            # If the host simply cannot accept this file at all
-            if result == CannotUpload:
-                cant_upload = True
-                break
-            # If the host was unable to accept the gif at this time
-            elif result == UploadFailed:
-                cant_upload = False
-                continue  # Try again?
-            # No error and not None, success!
-            elif result:
-                uploaded_gif = result
-                break
-
-        # If we have the uploaded gif, break out and continue
-        if uploaded_gif:
+        # The host is still encoding it, reply once it's done
+        elif isinstance(result, PendingUpload):
+            wait_for_encode(context, new_original_gif, result)
+            return PENDING
+        # No error and not None, success!
+        elif result and result != UploadFailed:
+            uploaded_gif = result
             break
+        # If the host was unable to accept the gif at this time
+        else:
+            cant_upload = False
 
     # If there was an error, return it
     if cant_upload:
+        journal.record(request, FAILED)
         return USER_FAILURE
     # It's not that it was an impossible request, there was something else
     elif not uploaded_gif:
         return UPLOAD_FAILURE
 
     if uploaded_gif:
-        # Add gif to database
-        # if reversed_gif.log:
-        add_to_database(new_original_gif, uploaded_gif)
-        # Reply
-        print("Replying!", uploaded_gif.url)
-        reply(context, uploaded_gif)
-        return SUCCESS
+        return replied(finish_request(context, new_original_gif, uploaded_gif))
     else:
         return UPLOAD_FAILURE
 
 
+def upload_reverse(ghm, original_gif, reversed_gif_file, hedge_deadline, ignore=None):
+    """Upload a reverse to the best host for it, trying twice. Returns the uploaded gif, a PendingUpload if the host
+    is still encoding it, CannotUpload if no host will take it or UploadFailed"""
+    options = ghm.get_upload_host(original_gif, file=reversed_gif_file, ignore=ignore)
+    # If there was no suitable upload host, this format cannot be uploaded
+    if not options:
+        return CannotUpload
+
+    # Using the provided host, perform the upload
+    upload_hosts = options[0]['hosts']
+    for i in range(2):
+        # Race a second host if the first is slow
+        if hedge_deadline and len(upload_hosts) > 1:
+            result = hedged_upload(upload_hosts, reversed_gif_file, original_gif.nsfw, hedge_deadline)
+        else:
+            result = monitored_upload(upload_hosts[0], reversed_gif_file.file, reversed_gif_file.type,
+                                      original_gif.nsfw, reversed_gif_file.audio)
+        # Anything but a temporary failure is final
+        if result and result != UploadFailed:
+            return result
+    return UploadFailed
+
+
+def spooled_file(state, original_gif):
+    return GifFile(open(state['spool'], "rb"), original_gif.host, state['type'], duration=state['duration'],
+                   audio=state['audio'])
+
+
+def in_progress(state):
+    """Whether a request is encoding on a host and being checked on by this process"""
+    return state['stage'] == ENCODING and EncodePoller.get().watching(state['ticket'])
+
+
+def still_encoding(request):
+    state = Journal.get().state(request)
+    return bool(state) and in_progress(state)
+
+
+def wait_for_encode(context, original_gif, pending: PendingUpload):
+    request = context.comment.fullname
+    Journal.get().record(request, ENCODING, host=pending.host.name, ticket=pending.ticket)
+    print("Waiting on", pending, "to finish encoding")
+    pending.on_done.append(lambda gif: finish_request(context, original_gif, gif))
+    pending.on_failed.append(lambda pending: encode_failed(context, original_gif, pending))
+    EncodePoller.get().add(pending)
+
+
+def encode_failed(context, original_gif, pending: PendingUpload):
+    """Upload the reverse to the next host, or leave it for the inbox to bring back and try again"""
+    journal = Journal.get()
+    request = context.comment.fullname
+    state = journal.state(request)
+    failures = state.get('encode_failures', 0) + 1
+    if failures >= MAX_ENCODE_FAILURES:
+        journal.record(request, FAILED, encode_failures=failures)
+        Operator.instance().message("{} failed to encode the reverse of {}, giving up after {} tries"
+                                    .format(pending, original_gif.url, failures), "Encode Failed")
+        return
+    spooled = state.get('spool', None) and os.path.exists(state['spool'])
+    # Back to having a reverse to upload, or nothing at all if it's gone. Either way the inbox will bring it back
+    journal.record(request, REVERSED if spooled else RECEIVED, encode_failures=failures)
+    if not spooled:
+        return
+    print(pending, "failed to encode, trying another host")
+    hedge_deadline = float(CredentialsLoader.get_credentials()['general'].get('hedge_deadline', 0))
+    result = upload_reverse(GifHostManager(), original_gif, spooled_file(state, original_gif), hedge_deadline,
+                            ignore=[pending.host])
+    if isinstance(result, PendingUpload):
+        wait_for_encode(context, original_gif, result)
+    elif result and result is not UploadFailed and result is not CannotUpload:
+        finish_request(context, original_gif, result)
+
+
+def replied(posted):
+    """Result of a request that ended with a reply, one that didn't get posted is tried again"""
+    return SUCCESS if posted else UPLOAD_FAILURE
+
+
+def finish_request(context, original_gif, uploaded_gif):
+    """Save and reply with an upload, returns whether the reply was posted. If it wasn't, the request stays uploaded
+    and the inbox brings it back to reply again"""
+    journal = Journal.get()
+    request = context.comment.fullname
+    # Can be called back from the encode poller
+    Tracer.get().begin(request)
+    journal.record(request, UPLOADED, host=uploaded_gif.host.name, id=uploaded_gif.id)
+    # Add gif to database
+    # if reversed_gif.log:
+    add_to_database(original_gif, uploaded_gif)
+    # Reply
+    print("Replying!", uploaded_gif.url)
+    posted = reply(context, uploaded_gif)
+    if posted:
+        journal.record(request, REPLIED)
+    return posted
+
+
+def resume_request(reddit, state):
+    """Finish off a request that was uploaded before a restart, or check on its encode again"""
+    Tracer.get().begin(state['request'])
+    ghm = GifHostManager(reddit)
+    context = CommentContext.from_json(reddit, state['context'])
+    original_gif = ghm.host_names[state['origin_host']].get_gif(state['origin_id'], nsfw=state['nsfw'])
+    host = ghm.host_names[state['host']]
+    if state['stage'] == UPLOADED:
+        print("Replying to", state['request'], "which was uploaded before the restart")
+        return replied(finish_request(context, original_gif, host.get_gif(state['id'], nsfw=state['nsfw'])))
+    print("Checking back on", state['request'], "which was encoding before the restart")
+    wait_for_encode(context, original_gif, PendingUpload(host, state['ticket'], nsfw=state['nsfw']))
+    return PENDING
+
+
+def resume_requests(reddit):
+    """Pick up the requests a crash or restart left uploaded but unanswered"""
+    for state in Journal.get().unfinished():
+        if state['stage'] in (UPLOADED, ENCODING):
+            try:
+                resume_request(reddit, state)
+            except Exception:
+                # Leave it in the journal, the inbox will bring it back if it wasn't marked read
+                traceback.print_exc()
+
+
 def process_mod_invite(reddit, message):
     subreddit_name = message.subject[26:]
     # Sanity
@@ -214,6 +452,7 @@ def process_mod_invite(reddit, message):
         subreddit = reddit.subreddit(subreddit_name)
         try:
             subreddit.mod.accept_invite()
+            ModeratedSubreddits.get(reddit).add(subreddit_name)
             print("Accepted moderatership at", subreddit_name)
             return subreddit_name
         except praw.exceptions.APIException as e:
@@ -223,6 +462,14 @@ def process_mod_invite(reddit, message):
 
 def is_reupload_needed(reddit, gif: Gif):
     if gif.id:
-        if gif.analyze():
+        # A cached lookup could say a gif that's since been deleted is still there
+        gif.forget()
+        # The check is nice to have, so let rate limited hosts skip it
+        try:
+            with low_priority():
+                if gif.analyze():
+                    return False
+        except RateLimited:
+            print("Skipping reupload check, {} is short on rate limit".format(gif.host))
             return False
     return True
@@ -1,4 +1,5 @@
 from pony.orm import Database, PrimaryKey, Required, Optional, db_session, select, commit, Json, Set, count, raw_sql
+from threading import Lock
 from core.history import bind_db
 from random import getrandbits
 from uuid import getnode
@@ -18,10 +19,19 @@ class ReverseJobs(db.Entity):
     origin_id = Required(str)
     assignee = Optional(QueueParticipants)
 
-bind_db(db)
+connect_lock = Lock()
+
+
+def connect():
+    """Bind the queue database the first time it's needed"""
+    with connect_lock:
+        if db.provider is None:
+            bind_db(db)
+
 
 class Queue:
     def __init__(self):
+        connect()
         self.name = str(getnode())
         print("Queue name is", self.name)
         self.tag = None
@@ -1,6 +1,19 @@
 import re
 from core import constants as consts
 
+
+class LazyPattern:
+    """Compiles a pattern the first time it's used, for patterns that depend on the config"""
+    def __init__(self, build):
+        self.build = build
+        self.pattern = None
+
+    def __get__(self, instance, owner):
+        if self.pattern is None:
+            self.pattern = self.build()
+        return self.pattern
+
+
 class REPatterns:
     # Reddit textpost pattern for avoiding text posts
     textpost = re.compile("^http(?:s)?://(?:\w+?\.)?reddit\.com/r/.*?/comments")
@@ -31,7 +44,7 @@ class REPatterns:
     streamable = re.compile("https?://streamable.com/([a-z0-9]*)")
 
     # Mention in a comment reply
-    reply_mention = re.compile("u/{}".format(consts.username.lower()), re.I)
+    reply_mention = LazyPattern(lambda: re.compile("u/{}".format(consts.username.lower()), re.I))
 
     # Markdown link
     link = re.compile("\[.*?\] *\n? *\((.*?)\)")
@@ -5,13 +5,18 @@ from core.context import CommentContext
 # from core.gif import Gif as GifObject
 from core.hosts import Gif as NewGifObject
 from core.operator import Operator
+from core.inbox import ReplyLatency
+from core.budget import REPLY, hold, parse_ratelimit
+from core.trace import traced
 from random import randrange
 # from core.credentials import CredentialsLoader
 #
 # credentials = CredentialsLoader().get_credentials()
 
 
+@traced("reply")
 def reply(context: CommentContext, gif):
+    """Returns False if nothing was posted and the reply should be tried again later"""
     # If we have a gif, use it's data. Else, use info from context
     if isinstance(gif, NewGifObject):
         url = gif.url
@@ -45,15 +50,19 @@ def reply(context: CommentContext, gif):
         if context.distinguish:
             comment.mod.distinguish(sticky=True)
 
+        ReplyLatency.record(context.comment)
         print("Successfully reversed and replied!")
     except praw.exceptions.APIException as e:
         if e.error_type == "RATELIMIT":
-            errtokens = e.message.split()
-            print("Oops! Hit the rate limit! Gotta wait " + errtokens[len(errtokens) - 2] + " " + errtokens[
-                len(errtokens) - 1])
+            # The summon stays unread and summons are left alone until Reddit lets us reply again
+            wait = parse_ratelimit(e.message)
+            print("Oops! Hit the rate limit! Holding off on replies for {}s".format(wait))
+            hold(REPLY, wait)
+            return False
         elif e.error_type == "THREAD_LOCKED":
             reply_message(comment, url)
         elif e.error_type == "DELETED_COMMENT":
+            # Nothing to reply to anymore, trying again won't help
             print("Comment was deleted, can't reply")
         else:
             print(e, dir(e))
@@ -61,6 +70,7 @@ def reply(context: CommentContext, gif):
     except prawcore.exceptions.Forbidden:
         # Probably banned, message the gif to them
         reply_message(comment, url)
+    return True
 
 
 def reply_message(comment, url):
@@ -0,0 +1,47 @@
+import time
+import threading
+import prawcore
+
+"""Requestor PRAW is set up with so we can see how many calls to Reddit each request costs and how much of the rate
+limit is left"""
+
+
+class RateBudget:
+    """Reddit's rate limit as of the last response, None until we've seen one"""
+    remaining = None
+    used = None
+    reset_at = 0
+
+    @classmethod
+    def update(cls, headers):
+        if "x-ratelimit-remaining" not in headers:
+            return
+        cls.remaining = float(headers["x-ratelimit-remaining"])
+        cls.used = int(headers.get("x-ratelimit-used", 0))
+        cls.reset_at = time.time() + int(headers.get("x-ratelimit-reset", 0))
+
+    @classmethod
+    def seconds_to_reset(cls):
+        return max(cls.reset_at - time.time(), 0)
+
+
+class CountingRequestor(prawcore.Requestor):
+    calls = 0
+    lock = threading.Lock()
+
+    def request(self, *args, **kwargs):
+        with CountingRequestor.lock:
+            CountingRequestor.calls += 1
+        response = super(CountingRequestor, self).request(*args, **kwargs)
+        RateBudget.update(response.headers)
+        return response
+
+
+class CallCounter:
+    """Counts the Reddit calls made between creating it and reading count"""
+    def __init__(self):
+        self.start = CountingRequestor.calls
+
+    @property
+    def count(self):
+        return CountingRequestor.calls - self.start
@@ -3,9 +3,17 @@ import os
 import json
 import platform
 from core import constants as consts
-from core.file import get_fps
+from core.file import get_fps, is_streamable
+from core.encoders import EncoderProfile, PROFILES, LARGE
+from core.fit import Fit
 from core.hosts import GifFile
 from core.operator import Operator
+from core.trace import traced
+
+
+# How each video reverse got its input. "disk" are files that would have failed through the pipe before, "fallback"
+# are ones that still failed through the pipe and had to be redone from the drive
+input_stats = {"pipe": 0, "disk": 0, "fallback": 0}
 
 
 def zeros(number, num_zeros=6):
@@ -13,10 +21,12 @@ def zeros(number, num_zeros=6):
     return "".join(["0" for i in range(num_zeros - len(string))]) + string
 
 
-def reverse_gif(image_file: GifFile, path=False, format=consts.GIF):
+@traced("reverse_gif")
+def reverse_gif(image_file: GifFile, path=False, format=consts.GIF, fit: Fit = None):
     """
     :param image: filestream to reverse
     :param path: if you just want the string path to the file instead of the filestream
+    :param fit: scale, frame rate and quality changes to fit a host's limits
     :return: filestream of a gif
     """
     image = image_file.file
@@ -51,9 +61,17 @@ def reverse_gif(image_file: GifFile, path=False, format=consts.GIF):
 
     print("Exporting frames...")
 
+    filters = []
+    quality = []
+    if fit:
+        filters = ["-vf", ",".join(fit.filters())] if fit.filters() else []
+        quality = ["--quality", str(fit.gifski_quality())]
+        if fit.fps:
+            fps = fit.fps
+
     # Reverse filenames
     p = subprocess.Popen(
-        [ffmpeg, "-loglevel", "quiet", "-i", filename, "-vsync", "0", "original%06d.png"]
+        [ffmpeg, "-loglevel", "quiet", "-i", filename] + filters + ["-vsync", "0", "original%06d.png"]
     )
     # Reverse frame order in export
     # p = subprocess.Popen(
@@ -97,12 +115,12 @@ def reverse_gif(image_file: GifFile, path=False, format=consts.GIF):
 
     if platform.system() == 'Windows':
         p = subprocess.Popen(
-            ['{}'.format(gifski), "-o", "../temp.gif", "--fps", str(max(round(fps), 1)), "frame*.png"],
+            ['{}'.format(gifski), "-o", "../temp.gif", "--fps", str(max(round(fps), 1))] + quality + ["frame*.png"],
             shell=True
         )
     else:
         p = subprocess.Popen(
-            ['{} -o ../temp.gif --fps {} frame*.png'.format(gifski, str(max(round(fps), 1)))],
+            ['{} -o ../temp.gif --fps {} {} frame*.png'.format(gifski, str(max(round(fps), 1)), " ".join(quality))],
             shell=True
         )
 
@@ -134,55 +152,67 @@ def reverse_gif(image_file: GifFile, path=False, format=consts.GIF):
         return open("temp.gif", "rb")
 
 
-def reverse_mp4(mp4, audio=False, format=consts.MP4, output=consts.MP4):
+@traced("reverse_mp4")
+def reverse_mp4(mp4, audio=False, format=consts.MP4, output=consts.MP4, profile: EncoderProfile = None,
+                fit: Fit = None):
     """
     :param mp4: filestream to reverse (must be a mp4)
+    :param profile: encoder settings, defaults to the large profile for the output type
+    :param fit: scale, frame rate and quality changes to fit a host's limits
     :return: filestream of an mp4
     """
     print("Reversing {} into {}...".format(format, output))
 
     mp4.seek(0)
 
-    # Create the params for the command
-
-    params = {"loglevel": "info", "audio": ""}
-
-    if output == consts.MP4:
-        params['codec'] = "-c:v libx264 -q:v 0"
-    elif output == consts.WEBM:
-        params['codec'] = "-c:v libvpx -crf 8 -b:v 1500K"
-
-    if audio:
-        params['audio'] = "-af areverse "
+    if not profile:
+        profile = PROFILES[output][LARGE]
+    # Shrink before reversing so the reverse filter buffers less
+    filters = ["reverse"]
+    if fit:
+        filters = fit.filters() + filters
+        profile = profile.with_crf_offset(fit.crf_offset)
 
     # Assemble command
 
-    command = "ffmpeg -loglevel {loglevel} -i pipe:0 -vf reverse {codec} {audio}-y temp.{output}".format(output=output,
-                                                                                                         **params)
-
-    # command = "ffmpeg -loglevel {loglevel} -i pipe:0 -y temp.{output}".format(output=output, **params)
+    command = ["ffmpeg", "-loglevel", "info", "-i", "pipe:0", "-vf", ",".join(filters)] + profile.params()
+    if audio:
+        command += ["-af", "areverse"]
+    command += ["-y", "temp." + output]
 
-    print(command)
-    command = command.split()
+    print(" ".join(command))
 
-    p = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    response = p.communicate(input=mp4.read())
+    in_file = "source." + format
+    # If the moov atom is at the end, FFmpeg can't read it from stdin so don't bother trying
+    if is_streamable(mp4):
+        input_stats['pipe'] += 1
+        p = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        response = p.communicate(input=mp4.read())
+
+        # print(response[0].decode() if response[0] else None, response[1].decode() if response[1] else None)
+
+        response = response[0].decode()
+        print(os.path.getsize('temp.' + output))
+        # Weird thing
+        # A blank mp4 is 48 bytes, a blank webm is ~~632 bytes~~
+        # Blank webm might be larger actually, using a percentage of the size of the original
+        # if output == consts.WEBM:
+        #     print("Checking if under", mp4.getbuffer().nbytes / 100)
+        failed = "partial file" in response or "Cannot allocate memory" in response or \
+            os.path.getsize('temp.' + output) <= (48 if output == consts.MP4 else (mp4.getbuffer().nbytes / 100))
+        if failed:
+            """"frame=    0 fps=0.0 q=0.0 size=       1kB time=00:00:00.00 bitrate=N/A"""
+            """"frame=    0 fps=0.0 q=0.0 size=       0kB time=00:00:00.00"""
+            print("FFMPEG gave weird error, putting in file to reverse")
+            input_stats['fallback'] += 1
+    else:
+        print("Media data comes before the moov atom, reversing from the drive")
+        input_stats['disk'] += 1
+        failed = True
 
-    # print(response[0].decode() if response[0] else None, response[1].decode() if response[1] else None)
+    print("Reverse inputs (pipe, disk, fallback):", input_stats['pipe'], input_stats['disk'], input_stats['fallback'])
 
-    response = response[0].decode()
-    print(os.path.getsize('temp.' + output))
-    # Weird thing
-    # A blank mp4 is 48 bytes, a blank webm is ~~632 bytes~~
-    # Blank webm might be larger actually, using a percentage of the size of the original
-    # if output == consts.WEBM:
-    #     print("Checking if under", mp4.getbuffer().nbytes / 100)
-    if "partial file" in response or "Cannot allocate memory" in response or \
-            os.path.getsize('temp.' + output) <= (48 if output == consts.MP4 else (mp4.getbuffer().nbytes / 100)):
-        """"frame=    0 fps=0.0 q=0.0 size=       1kB time=00:00:00.00 bitrate=N/A"""
-        """"frame=    0 fps=0.0 q=0.0 size=       0kB time=00:00:00.00"""
-        print("FFMPEG gave weird error, putting in file to reverse")
-        in_file = "source." + format
+    if failed:
         command[4] = in_file
         mp4.seek(0)
         with open(in_file, 'wb') as f:
@@ -190,41 +220,6 @@ def reverse_mp4(mp4, audio=False, format=consts.MP4, output=consts.MP4):
 
         p = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
         response = p.communicate()[0].decode()
-
-        # print(response)
-        # Did we fail again?
-        # if "partial file" in response or "Cannot allocate memory" in response or os.path.getsize('temp.' + output) <= (48 if output == consts.MP4 else 632):
-        #     # Just export frames and reconstruct
-        #     print("Exporting frames")
-        #     # Get FPS
-        #     # Gross hack, fix it later with integrated GifFile metadata
-        #     fps = get_fps(in_file)
-        #
-        #     os.chdir("temp")
-        #
-        #     # Export frames
-        #     p = subprocess.Popen(
-        #         [ffmpeg, "-loglevel", "quiet", "-i", "../" + in_file, "original%06d.png"]
-        #     )
-        #
-        #     response = p.communicate()
-        #
-        #     print("Renaming...")
-        #     # Reverse filenames
-        #     for i in os.walk("."):
-        #         files = i[2]
-        #         break
-        #
-        #     counter = len(files)
-        #     for i in range(1, len(files) + 1):
-        #         os.rename("original{}.png".format(zeros(i)), "frame{}.png".format(zeros(counter)))
-        #         counter -= 1
-        #
-        #     # Statistics
-        #     for i in os.walk("."):
-        #         files = i[2]
-        #         break
-
         os.remove(in_file)
 
     if os.path.getsize('temp.' + output) <= (48 if output == consts.MP4 else 632):
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import tempfile
+import threading
+from contextlib import contextmanager
+from core.credentials import CredentialsLoader
+
+try:
+    import fcntl
+except ImportError:
+    # No cross process locking on Windows, threads are still covered
+    fcntl = None
+
+"""OAuth tokens shared by every process using the same credentials. Tokens live in tokens.json next to
+credentials.ini, written atomically so readers never see half a file. Refreshing happens under a lock file and the
+store is read again once the lock is held, so when several workers notice an expiring token only the first one
+actually hits the OAuth endpoint and the rest pick up its result"""
+
+REFRESH_AHEAD = 5 * 60      # Refresh tokens this long before they expire
+
+
+def fresh(token):
+    return bool(token and token.get('access_token') and token.get('expires', 0) - REFRESH_AHEAD > time.time())
+
+
+class TokenStore:
+    instance = None
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(os.path.dirname(os.path.abspath(CredentialsLoader.path)), "tokens.json")
+        self.lock_path = self.path + ".lock"
+        self.thread_lock = threading.Lock()
+        self.cache = {}
+
+    @classmethod
+    def get(cls):
+        if not cls.instance:
+            cls.instance = cls()
+        return cls.instance
+
+    @contextmanager
+    def locked(self):
+        with self.thread_lock:
+            with open(self.lock_path, "a") as lock:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write(self, tokens):
+        # Write to a temp file and swap it in so the store is never left half written
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix=".tokens")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(tokens, f, indent=2)
+            os.replace(temp, self.path)
+        except Exception:
+            os.remove(temp)
+            raise
+
+    def load(self, service):
+        return self._read().get(service, None)
+
+    def save(self, service, token):
+        with self.locked():
+            tokens = self._read()
+            tokens[service] = token
+            self._write(tokens)
+        self.cache[service] = token
+
+    def token(self, service, refresh, seed=None):
+        """
+        Get a usable token for a service, refreshing it if it's about to expire
+        :param service: name the token is stored under
+        :param refresh: function taking the stale token and returning a new one
+        :param seed: token to start from if the store doesn't have one yet
+        :return: token dict with access_token, refresh_token and expires
+        """
+        token = self.cache.get(service, None)
+        if fresh(token):
+            return token
+        token = self.load(service) or token or seed
+        if not fresh(token):
+            with self.locked():
+                # Someone else might have refreshed it while we waited
+                stored = self.load(service)
+                if fresh(stored):
+                    token = stored
+                else:
+                    print("Refreshing", service, "token")
+                    token = refresh(stored or token)
+                    tokens = self._read()
+                    tokens[service] = token
+                    self._write(tokens)
+        self.cache[service] = token
+        return token
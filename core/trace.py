@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import threading
+from io import BytesIO
+from functools import wraps
+from contextlib import contextmanager
+from core.credentials import CredentialsLoader
+
+try:
+    import resource
+except ImportError:
+    # Windows, child CPU time isn't reported there
+    resource = None
+
+"""Records how long each stage of a request took as JSON lines in traces.jsonl, so a slow request can be picked apart
+afterwards. Every span has the request it belongs to, its parent span, wall time, CPU time spent in child processes
+(FFmpeg, gifski), bytes in and out where there are any and how it turned out. Child CPU is counted for the whole
+process, so it's only exact while one request is being worked on at a time"""
+
+
+class Tracer:
+    instance = None
+
+    def __init__(self, path=None):
+        root = os.path.dirname(os.path.abspath(CredentialsLoader.path))
+        self.path = path or os.path.join(root, "traces.jsonl")
+        self.enabled = self.configured()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # Threads that weren't handed a request (like hedged uploads) belong to the last one started
+        self.last_request = None
+
+    @classmethod
+    def get(cls):
+        if cls.instance is None:
+            cls.instance = cls()
+        return cls.instance
+
+    @staticmethod
+    def configured():
+        """Tools and tests probe files without a config, tracing is just off for them"""
+        try:
+            general = CredentialsLoader.get_credentials()['general']
+        except Exception:
+            return False
+        return general.get('trace', "false").lower() == "true"
+
+    def begin(self, request):
+        """Following spans on this thread belong to this request"""
+        if getattr(self.local, "request", None) != request:
+            self.local.request = request
+            self.local.stack = []
+        self.last_request = request
+
+    def request(self):
+        return getattr(self.local, "request", None) or self.last_request
+
+    def stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def write(self, entry):
+        line = json.dumps(entry, default=str) + "\n"
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(line)
+
+
+def child_cpu():
+    """CPU seconds used by finished child processes, None where that can't be found out"""
+    if not resource:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def size_of(item):
+    """Bytes in a file, filestream or GifFile, None if it isn't one"""
+    file = getattr(item, "file", item)
+    try:
+        if isinstance(file, BytesIO):
+            return file.getbuffer().nbytes
+        if hasattr(file, "fileno"):
+            return os.fstat(file.fileno()).st_size
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+@contextmanager
+def span(name, **fields):
+    """
+    Time a stage of the current request. Yields a dict that the stage can add fields to, set its outcome with
+    "outcome" or what it moved with "bytes_in" and "bytes_out"
+    """
+    tracer = Tracer.get()
+    if not tracer.enabled:
+        yield {}
+        return
+    stack = tracer.stack()
+    entry = {"request": tracer.request(), "span": name, "parent": stack[-1] if stack else None, "outcome": "ok",
+             **fields}
+    stack.append(name)
+    entry["start"] = time.time()
+    start, cpu = time.perf_counter(), child_cpu()
+    try:
+        yield entry
+    except Exception as e:
+        entry["outcome"] = "error: {}".format(type(e).__name__)
+        raise
+    finally:
+        entry["wall"] = round(time.perf_counter() - start, 4)
+        entry["child_cpu"] = round(child_cpu() - cpu, 4) if cpu is not None else None
+        if stack:
+            stack.pop()
+        tracer.write(entry)
+
+
+def traced(name, outcome=None):
+    """
+    Trace every call of a function as a span
+    :param outcome: turns the function's result into its outcome. By default a list or a falsy result other than None
+    is "failed" and a class (like UploadFailed) is its name
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name) as entry:
+                if entry:
+                    entry["bytes_in"] = next((size for size in map(size_of, args) if size is not None), None)
+                result = function(*args, **kwargs)
+                if entry:
+                    if outcome:
+                        entry["outcome"] = outcome(result)
+                    elif isinstance(result, type):
+                        entry["outcome"] = result.__name__
+                    elif isinstance(result, list) or (result is not None and not result):
+                        entry["outcome"] = "failed"
+                    entry["bytes_out"] = size_of(result)
+                return result
+        return wrapper
+    return decorator
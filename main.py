@@ -1,37 +1,62 @@
-import praw
 import prawcore
 from requests.exceptions import ConnectionError
 import time
 import traceback
-from core.process import process_comment, process_mod_invite
-from core.credentials import CredentialsLoader
+from core.bootstrap import Bootstrap
+from core.process import prepare_request, reverse_request, process_mod_invite, resume_requests, still_encoding
+from core.backlog import Backlog
+from core.journal import Journal
+from core.trace import Tracer
+from core.poller import EncodePoller
+from core.health import HealthTracker
+from core.requestor import CallCounter
+from core.inbox import PollScheduler, ReplyLatency
+from core.budget import ActionScheduler, MARK_READ, wait_for
 from core.regex import REPatterns
 from core import constants as consts
 from core.constants import SUCCESS, USER_FAILURE, UPLOAD_FAILURE
 from core.secret import secret_process
 from core.arguments import parser
-from core.operator import Operator
 from pony.orm.dbapiprovider import OperationalError
 
-credentials = CredentialsLoader().get_credentials()
+args = parser.parse_args()
 
-mode = credentials['general']['mode']
-operator = credentials['general']['operator']
+app = Bootstrap.get()
+credentials = app.credentials
+reddit = app.reddit
+new_operator = app.operator
+# Make sure the database is reachable before we start
+app.database()
 
-reddit = praw.Reddit(user_agent=consts.user_agent,
-                     client_id=credentials['reddit']['client_id'],
-                     client_secret=credentials['reddit']['client_secret'],
-                     username=credentials['reddit']['username'],
-                     password=credentials['reddit']['password'])
+print(f"{consts.bot_name} v{consts.version} Ctrl+C to stop")
 
-args = parser.parse_args()
+# Finish anything a crash or restart left uploaded but unanswered
+resume_requests(reddit)
 
-new_operator = Operator(reddit.redditor(operator), credentials['general'].get('testing', "false").lower() == "true")
 
-print(f"{consts.bot_name} v{consts.version} Ctrl+C to stop")
+def mark_as_read(messages):
+    # Replies get the rate limit first
+    wait_for(MARK_READ)
+    reddit.inbox.mark_read(messages)
+    messages.clear()
+
+
+def settle(message, result):
+    """Mark a summon read unless it should be tried again, returns whether the upload failed"""
+    # Depending on success or other outcomes, we mark the message read
+    if result == SUCCESS or result == USER_FAILURE:
+        mark_read.append(message)
+    # If the upload failed, try again later
+    elif result == UPLOAD_FAILURE:
+        print("Upload failed, not removing from queue")
+        return True
+    # If it's still encoding, it gets marked read once it's replied to
+    return False
+
 
 mark_read = []
 failure_counter = 1  # 1 by default since it is the wait timer multiplier
+poller = PollScheduler()
 db_connected = True
 
 # Queue mode
@@ -40,41 +65,51 @@ if args.queue:
     q = None
 else:
     # Use the queue
-    from core.queue import Queue
-    q = Queue()
+    q = app.queue()
 
 while True:
     try:
         failure = False
+        activity = False
         if mark_read:   # Needed to clear after a Reddit disconnection error
-            reddit.inbox.mark_read(mark_read)
-            mark_read.clear()
+            mark_as_read(mark_read)
+        # Reply to anything that finished encoding in the background
+        EncodePoller.get().drain()
+        # Pick up hosts other nodes found to be down
+        HealthTracker.sync()
+        # Summons that need reversing, done once the cheap ones are answered
+        backlog = Backlog()
         # for all unread messages
         for message in reddit.inbox.unread():
+            # Summons that are still encoding stay unread until they're replied to
+            if message.was_comment and still_encoding(message.fullname):
+                continue
+            activity = True
             # for all unread comments
             if message.was_comment:
                 result = None
+                context = gif = None
+                reddit_calls = CallCounter()
+                Tracer.get().begin(message.fullname)
                 # Comments that arrive the same time the inbox is being checked may not have an ID?
                 if not message.id:
                     new_operator.message("Message had no ID???")
                 # username mentions are simple
                 if message.subject == "username mention":
-                    result = process_comment(reddit, reddit.comment(message.id), q)
+                    result, context, gif = prepare_request(reddit, reddit.comment(message.id), q)
                 # if it was a reply, check to see if it contained a summon
                 elif message.subject == "comment reply" or message.subject == "post reply":
                     if REPatterns.reply_mention.findall(message.body):
-                        result = process_comment(reddit, reddit.comment(message.id), q)
+                        result, context, gif = prepare_request(reddit, reddit.comment(message.id), q)
                     else:
                         secret_process(reddit, message)
                         result = SUCCESS
                 new_operator.unset_request_info()
-                # Depending on success or other outcomes, we mark the message read
-                if result == SUCCESS or result == USER_FAILURE:
-                    mark_read.append(message)
-                # If the upload failed, try again later
-                elif result == UPLOAD_FAILURE:
-                    failure = True
-                    print("Upload failed, not removing from queue")
+                print("Request used {} Reddit calls".format(reddit_calls.count))
+                if context:
+                    backlog.add(message, context, gif)
+                else:
+                    failure = settle(message, result) or failure
             else:  # was a message
                 # if message.first_message == "None":
                 #     message.reply("Sorry, I'm only a bot! I'll contact my creator /u/pmdevita for you.")
@@ -88,8 +123,7 @@ while True:
                     new_operator.message(message.subject + "\n\n---\n\n" + message.body, "Message", False, True)
                 mark_read.append(message)
             if len(mark_read) >= 5:     # Mark read every 5 in a batch to avoid a small chance of disaster
-                reddit.inbox.mark_read(mark_read)
-                mark_read.clear()
+                mark_as_read(mark_read)
             if not db_connected:
                 db_connected = True
                 new_operator.message("The bot was able to reconnect to the database.", "DB Reconnected")
@@ -98,9 +132,20 @@ while True:
                 if len(input()):
                     print("You can now safely end the process")
                     break
+        for job in backlog:
+            reddit_calls = CallCounter()
+            Tracer.get().begin(job.message.fullname)
+            new_operator.set_request_info(job.context.to_json())
+            result = reverse_request(reddit, job.context, job.gif)
+            new_operator.unset_request_info()
+            print("Request used {} Reddit calls".format(reddit_calls.count))
+            failure = settle(job.message, result) or failure
+            if len(mark_read) >= 5:
+                mark_as_read(mark_read)
         if mark_read:
-            reddit.inbox.mark_read(mark_read)
-            mark_read.clear()
+            mark_as_read(mark_read)
+        # Everything the journal finished has been marked read by now
+        Journal.get().tidy()
         if failure:
             print("An upload failed, extending wait")
             # failure_counter += 1
@@ -110,7 +155,10 @@ while True:
         if q:
             q.clean()
 
-        time.sleep(consts.sleep_time * failure_counter)
+        if activity:
+            print(ReplyLatency.summary())
+        # Check again soon after activity, back off when it's quiet
+        time.sleep(poller.next_wait(activity, failure) * failure_counter)
 
     except prawcore.exceptions.ResponseException as e:   # Something funky happened
         print("Did a comment go missing?", e, vars(e))
@@ -122,6 +170,10 @@ while True:
 
     except KeyboardInterrupt:
         reddit.inbox.mark_read(mark_read)
+        if len(EncodePoller.get()):
+            print("Abandoning {} uploads that were still encoding".format(len(EncodePoller.get())))
+        EncodePoller.get().stop()
+        ActionScheduler.get().flush()
         print("Exiting...")
         break
 
@@ -141,4 +193,6 @@ while True:
         reddit.inbox.mark_read(mark_read)
         new_operator.message("Help I crashed!\n\n    {}".format(str(traceback.format_exc()).replace('\n', '\n    ')),
                              "Error!", False)
+        # Make sure the crash report goes out before we do
+        ActionScheduler.get().flush()
         raise
@@ -1,6 +1,5 @@
 import unittest
-import praw
-from core.credentials import CredentialsLoader
+from core.bootstrap import Bootstrap
 from core import constants as consts
 from core.context import CommentContext
 from core.gif import GifHostManager
@@ -8,13 +7,7 @@ from core.gif import GifHostManager
 """These tests rely on comments on in my test subreddit so they'll need some work for other people to use"""
 
 
-credentials = CredentialsLoader().get_credentials()
-
-reddit = praw.Reddit(user_agent=consts.user_agent,
-                     client_id=credentials['reddit']['client_id'],
-                     client_secret=credentials['reddit']['client_secret'],
-                     username=credentials['reddit']['username'],
-                     password=credentials['reddit']['password'])
+reddit = Bootstrap.get().reddit
 
 
 ghm = GifHostManager(reddit=reddit)
@@ -1,19 +1,12 @@
 import unittest
-import praw
-from core.credentials import CredentialsLoader
+from core.bootstrap import Bootstrap
 from core import constants as consts
 from core.gif import GifHostManager
 
 """These tests rely on comments on in my test subreddit so they'll need some work for other people to use"""
 
 
-credentials = CredentialsLoader().get_credentials()
-
-reddit = praw.Reddit(user_agent=consts.user_agent,
-                     client_id=credentials['reddit']['client_id'],
-                     client_secret=credentials['reddit']['client_secret'],
-                     username=credentials['reddit']['username'],
-                     password=credentials['reddit']['password'])
+reddit = Bootstrap.get().reddit
 
 ghm = GifHostManager(reddit=reddit)
 
@@ -26,3 +19,15 @@ class GHLTests(unittest.TestCase):
         # Self posts should not end in infinite recursion
         self.assertIsNone(ghm.extract_gif(text="https://www.reddit.com/user/GifReversingBot/comments/b44fkn/how_to_use_gifreversingbot"))
 
+
+    def test_match_host(self):
+        # The combined matcher should pick the same host as checking every host's regex
+        cases = {"Look at this https://imgur.com/5PVtWsf.gifv": "Imgur",
+                 "https://gfycat.com/SkeletalShallowArmadillo": "Gfycat",
+                 "https://files.catbox.moe/abc123.mp4": "Catbox",
+                 "https://i.redd.it/lhbqeh1x75e61.gif": "RedditGif",
+                 "https://media4.giphy.com/media/VaZps4e5JECKSmtdOH/giphy.gif": "LinkGif",
+                 "no links here": None}
+        for text, name in cases.items():
+            host, match = ghm.match_host(text)
+            self.assertEqual(name, host.name if host else None)
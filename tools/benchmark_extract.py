@@ -0,0 +1,73 @@
+# Add project root folder to python path
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+import json
+import time
+import praw
+from core.bootstrap import Bootstrap
+from core.gif import GifHostManager
+
+"""Benchmarks finding the host of a link in comment bodies, comparing the combined matcher against checking every
+host's regex. Comment bodies are read from a JSON list, or pulled from the bot's mentions and saved if the file
+doesn't exist yet.
+
+Usage: python tools/benchmark_extract.py [corpus.json]"""
+
+ROUNDS = 20
+
+
+def fetch_corpus(path):
+    reddit = Bootstrap.get().reddit
+    corpus = []
+    # Summons and the comments above them are what get scanned in practice
+    for mention in reddit.inbox.mentions(limit=500):
+        corpus.append(mention.body)
+        parent = mention.parent()
+        corpus.append(parent.body if isinstance(parent, praw.models.Comment) else parent.url)
+    with open(path, "w") as f:
+        json.dump(corpus, f)
+    return corpus
+
+
+def legacy_match_host(ghm, text):
+    for host in ghm.hosts:
+        if host.match(text):
+            return host
+    return None
+
+
+def main(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            corpus = json.load(f)
+    else:
+        corpus = fetch_corpus(path)
+    ghm = GifHostManager()
+
+    mismatches = 0
+    for text in corpus:
+        if ghm.match_host(text)[0] != legacy_match_host(ghm, text):
+            mismatches += 1
+
+    start = time.perf_counter()
+    for i in range(ROUNDS):
+        for text in corpus:
+            legacy_match_host(ghm, text)
+    legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(ROUNDS):
+        for text in corpus:
+            ghm.match_host(text)
+    combined = time.perf_counter() - start
+
+    calls = ROUNDS * len(corpus)
+    print("{} comment bodies, {} mismatches".format(len(corpus), mismatches))
+    print("Every host: {:.2f} us/comment".format(legacy / calls * 1000000))
+    print("Combined:   {:.2f} us/comment".format(combined / calls * 1000000))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else "corpus.json")
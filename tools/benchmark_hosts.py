@@ -0,0 +1,34 @@
+# Add project root folder to python path
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+import timeit
+from types import SimpleNamespace
+from core import constants as consts
+from core.gif import GifHostManager
+
+"""Microbenchmark for picking an upload host for an already reversed file"""
+
+CALLS = 100000
+
+ghm = GifHostManager()
+
+
+def file(gif_type, size, duration=10, frames=300, audio=False, host=None):
+    return SimpleNamespace(type=gif_type, size=size, duration=duration, frames=frames, audio=audio, host=host)
+
+
+cases = {
+    "small gif": (SimpleNamespace(nsfw=False), file(consts.GIF, 5)),
+    "large gif": (SimpleNamespace(nsfw=False), file(consts.GIF, 150, frames=2000)),
+    "nsfw mp4": (SimpleNamespace(nsfw=True), file(consts.MP4, 20, audio=True)),
+    "long mp4 from origin": (SimpleNamespace(nsfw=False), file(consts.MP4, 80, duration=300, host=ghm['Catbox'])),
+    "too big": (SimpleNamespace(nsfw=False), file(consts.MP4, 5000)),
+}
+
+for name, (gif, gif_file) in cases.items():
+    seconds = timeit.timeit(lambda: ghm.get_upload_host(gif, file=gif_file), number=CALLS)
+    result = ghm.get_upload_host(gif, file=gif_file)
+    print("{:<22} {:>8.2f} us/call {}".format(name, seconds / CALLS * 1000000,
+                                             [h.name for h in result[0]['hosts']] if result else None))
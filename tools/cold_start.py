@@ -0,0 +1,36 @@
+# Add project root folder to python path
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+import subprocess
+
+"""Measures how long it takes a fresh interpreter to import the bot's entry point modules
+
+Usage: python tools/cold_start.py [runs]"""
+
+ROOT = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..")
+MODULES = ["core.process", "core.history", "core.queue", "core.gif"]
+
+SCRIPT = "import time; start = time.perf_counter(); import {}; print(time.perf_counter() - start)"
+
+
+def measure(module, runs):
+    times = []
+    for i in range(runs):
+        output = subprocess.run([sys.executable, "-c", SCRIPT.format(module)], cwd=ROOT, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        if output.returncode:
+            print(module, "failed to import:", output.stderr.decode().strip().split("\n")[-1])
+            return None
+        times.append(float(output.stdout.decode()))
+    # tools/statistics.py shadows the statistics module here
+    return sorted(times)[len(times) // 2]
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    for module in MODULES:
+        median = measure(module, runs)
+        if median is not None:
+            print("{:<14} {:>8.1f} ms".format(module, median * 1000))
@@ -1,23 +1,18 @@
-import praw
 import datetime
 import pony
-from core.credentials import CredentialsLoader
+from core.bootstrap import Bootstrap
 from core import constants as consts
-from core.gif import GifHostManager
 from core.regex import REPatterns
 
-credentials = CredentialsLoader().get_credentials()
+app = Bootstrap.get()
+credentials = app.credentials
 
 mode = credentials['general']['mode']
 operator = credentials['general']['operator']
 
-reddit = praw.Reddit(user_agent=consts.user_agent,
-                     client_id=credentials['reddit']['client_id'],
-                     client_secret=credentials['reddit']['client_secret'],
-                     username=credentials['reddit']['username'],
-                     password=credentials['reddit']['password'])
+reddit = app.reddit
 
-ghm = GifHostManager(reddit)
+ghm = app.ghm
 
 print(f"{consts.bot_name} Console v{consts.version}")
 
@@ -0,0 +1,81 @@
+# Add project root folder to python path
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+import json
+import resource
+import subprocess
+import time
+from collections import defaultdict
+from core.encoders import CANDIDATES, PROFILES, size_class
+from core.file import MediaInfo
+from core.gif import GifHostManager
+
+"""Reverses a folder of sample videos with every candidate encoder profile and picks, for each host and size class,
+the profile with the lowest CPU time whose output fits under the host's video size limit.
+
+Usage: python tools/encoder_benchmark.py <folder of sample videos>"""
+
+
+def run(path, profile, output):
+    """Returns CPU seconds and output size in MB"""
+    command = ["ffmpeg", "-loglevel", "quiet", "-i", path, "-vf", "reverse"] + profile.params() + \
+              ["-an", "-y", "benchmark." + output]
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    subprocess.Popen(command).communicate()
+    wall = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    size = os.path.getsize("benchmark." + output) / 1000000
+    os.remove("benchmark." + output)
+    return cpu, wall, size
+
+
+def main(folder):
+    samples = [os.path.join(folder, f) for f in sorted(os.listdir(folder))]
+    # results[video type][size class][profile name] = [(cpu, size), ...]
+    results = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+    profiles = {}
+    for sample in samples:
+        with open(sample, "rb") as f:
+            info = MediaInfo(f)
+        if not info.video:
+            continue
+        size = size_class(*info.dimensions)
+        for output, candidates in CANDIDATES.items():
+            for profile in candidates:
+                cpu, wall, mb = run(sample, profile, output)
+                profiles[profile.name] = profile
+                results[output][size][profile.name].append((cpu, mb))
+                print(os.path.basename(sample), size, profile, "cpu {:.2f}s wall {:.2f}s {:.2f}MB".format(cpu, wall, mb))
+
+    ghm = GifHostManager()
+    picks = {}
+    for host in ghm.vid_priority:
+        output = host.video_type
+        picks[host.name] = {}
+        for size, by_profile in results[output].items():
+            best = None
+            for name, runs in by_profile.items():
+                # Must fit every sample under the host's limit
+                if host.vid_size_limit and max(mb for cpu, mb in runs) > host.vid_size_limit:
+                    continue
+                total_cpu = sum(cpu for cpu, mb in runs)
+                if best is None or total_cpu < best[1]:
+                    best = (name, total_cpu)
+            if best:
+                current = PROFILES[output][size].name
+                picks[host.name][size] = best[0]
+                print("{} {} {}: {} ({:.2f}s cpu), current default {}".format(host.name, output, size, best[0],
+                                                                             best[1], current))
+    with open("encoder_benchmark.json", "w") as f:
+        json.dump(picks, f, indent=4)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python tools/encoder_benchmark.py <folder of sample videos>")
+    else:
+        main(sys.argv[1])
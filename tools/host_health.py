@@ -0,0 +1,18 @@
+# Add project root folder to python path
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+import time
+from core.history import load_host_health
+
+"""Show the upload health of each host as last reported by each node"""
+
+print("{:<16} {:<16} {:<10} {:>8} {:>8} {:>8} {:>10}".format("Host", "Node", "State", "Success", "p50", "p95",
+                                                              "Updated"))
+for health in sorted(load_host_health(), key=lambda h: (h['name'], h['node'])):
+    def fmt(value, spec):
+        return format(value, spec) if value is not None else "-"
+    print("{:<16} {:<16} {:<10} {:>8} {:>8} {:>8} {:>9.0f}s".format(
+        health['name'], health['node'], health['state'], fmt(health['success_rate'], ".0%"), fmt(health['p50'], ".1f"),
+        fmt(health['p95'], ".1f"), time.time() - health['updated']))
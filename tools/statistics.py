@@ -2,7 +2,7 @@ import praw
 import prawcore
 import time
 import traceback
-from core.credentials import CredentialsLoader
+from core.bootstrap import Bootstrap
 from core.regex import REPatterns
 from core import constants as consts
 
@@ -10,18 +10,9 @@ from pprint import pprint
 import json
 import datetime
 from collections import defaultdict
-from core.gif import GifHostManager
 
-credentials = CredentialsLoader().get_credentials()
-
-mode = credentials['general']['mode']
-operator = credentials['general']['operator']
-
-reddit = praw.Reddit(user_agent=consts.user_agent,
-                     client_id=credentials['reddit']['client_id'],
-                     client_secret=credentials['reddit']['client_secret'],
-                     username=credentials['reddit']['username'],
-                     password=credentials['reddit']['password'])
+app = Bootstrap.get()
+reddit = app.reddit
 
 
 def get_date(seconds):
@@ -31,7 +22,7 @@ def get_date(seconds):
 
 print("GifReversingBot Statistics v{} Ctrl+C to stop".format(consts.version))
 
-ghm = GifHostManager(reddit)
+ghm = app.ghm
 counter = 0
 users = defaultdict(int)
 karma = {}